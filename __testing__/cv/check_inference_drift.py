@@ -0,0 +1,92 @@
+import argparse
+import copy
+import csv
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "backend"))
+
+from anomalib.engine import Engine
+from anomalib.models import Patchcore
+from anomalib.data import PredictDataset
+from utils.torch_utils import optimize_patchcore_for_cpu
+
+# Compares pred_score of the optimized CPU path (channels-last, bf16, torch.compile)
+# against a fresh fp32 run and against the scores recorded in a predictions.csv.
+
+
+def load_reference_scores(csv_path: Path) -> dict:
+    """Map image filename -> pred_score from a predictions.csv (path column may be a list repr)."""
+    scores = {}
+    with open(csv_path, newline="") as f:
+        for row in csv.reader(f):
+            if len(row) < 3:
+                continue
+            path = row[1].strip("[]'\" ")
+            scores[Path(path).name] = float(row[2])
+    return scores
+
+
+def predict_scores(model, dataset, checkpoint_path) -> dict:
+    engine = Engine()
+    start = time.perf_counter()
+    results = engine.predict(model=model, dataset=dataset, ckpt_path=checkpoint_path)
+    elapsed = time.perf_counter() - start
+    scores = {Path(r.image_path[0]).name: (float(r.pred_score.item()), int(r.pred_label.item())) for r in results}
+    return scores, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check pred_score drift of optimized CPU inference against fp32")
+    parser.add_argument("--image_dir", type=str, required=True, help="Directory with the images listed in the CSV")
+    parser.add_argument("--predictions_csv", type=str, default="backend/interaction/inference_outputs/predictions.csv")
+    parser.add_argument("--checkpoint", type=str, default="backend/patchcore/drone/v25/weights/lightning/model.ckpt")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="Max allowed absolute pred_score drift")
+    parser.add_argument("--no_bf16", action="store_true")
+    parser.add_argument("--no_compile", action="store_true")
+    args = parser.parse_args()
+
+    reference = load_reference_scores(Path(args.predictions_csv))
+    dataset = PredictDataset(path=Path(args.image_dir), image_size=(320, 256))
+
+    baseline_model = Patchcore(
+        backbone="resnet18",
+        layers=["layer2", "layer3"],
+        pre_trained=True,
+        coreset_sampling_ratio=0.1,
+        num_neighbors=9,
+    )
+    optimized_model = optimize_patchcore_for_cpu(copy.deepcopy(baseline_model), bf16=not args.no_bf16,
+                                                 compile_graph=not args.no_compile)
+
+    print("Running fp32 baseline...")
+    baseline, baseline_time = predict_scores(baseline_model, dataset, args.checkpoint)
+    # First optimized pass pays for compilation; time the second one
+    print("Running optimized path (warm-up)...")
+    predict_scores(optimized_model, dataset, args.checkpoint)
+    print("Running optimized path...")
+    optimized, optimized_time = predict_scores(optimized_model, dataset, args.checkpoint)
+
+    drifts, csv_drifts, label_flips = [], [], []
+    for name, (score, label) in sorted(baseline.items()):
+        opt_score, opt_label = optimized[name]
+        drifts.append(abs(opt_score - score))
+        if opt_label != label:
+            label_flips.append(name)
+        if name in reference:
+            csv_drifts.append(abs(opt_score - reference[name]))
+        print(f"{name}: fp32={score:.5f} optimized={opt_score:.5f} drift={abs(opt_score - score):.5f}"
+              + (f" csv={reference[name]:.5f}" if name in reference else ""))
+
+    print(f"\nImages: {len(drifts)} (matched in CSV: {len(csv_drifts)})")
+    print(f"pred_score drift vs fp32: max={max(drifts):.5f} mean={sum(drifts) / len(drifts):.5f}")
+    if csv_drifts:
+        print(f"pred_score drift vs CSV:  max={max(csv_drifts):.5f} mean={sum(csv_drifts) / len(csv_drifts):.5f}")
+    print(f"Label flips: {len(label_flips)} {label_flips[:10]}")
+    print(f"Time: fp32={baseline_time:.2f}s optimized={optimized_time:.2f}s speedup={baseline_time / optimized_time:.2f}x")
+
+    if max(drifts) > args.tolerance or label_flips:
+        print("❌ Optimized inference drifts beyond tolerance")
+        sys.exit(1)
+    print("✅ Optimized inference within tolerance")
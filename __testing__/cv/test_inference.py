@@ -1,4 +1,3 @@
-from anomalib.engine import Engine
 from anomalib.models import Patchcore
 from anomalib.data import PredictDataset
 from pathlib import Path
@@ -7,10 +6,9 @@ import numpy as np
 from skimage.segmentation import mark_boundaries
 
 from inference_utils import save_prediction_outputs
+from predict_utils import stream_predict
 
 if __name__ == "__main__":
-    engine = Engine()
-
     # Load dataset with specified image size
     dataset = PredictDataset(path=Path("datasets/drone/all_test"), image_size=(256, 320))
 
@@ -28,12 +26,10 @@ if __name__ == "__main__":
         num_neighbors=9,
     )
 
-    print("Running inference...")
-    results = engine.predict(model=model, dataset=dataset, ckpt_path=checkpoint_path)
-
     output_dir = Path("inference_outputs")
     output_dir.mkdir(exist_ok=True)
-    print(f"Saving results to {output_dir}")
+    print(f"Running inference, saving results to {output_dir}")
 
-    for result in results:
+    # Each batch is saved as soon as it is predicted instead of after the whole dataset
+    for result in stream_predict(model, dataset, checkpoint_path):
         save_prediction_outputs(result, output_dir)
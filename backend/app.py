@@ -1,11 +1,30 @@
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
+from fastapi.staticfiles import StaticFiles
 from pathlib import Path
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import queue
+import re
 import shutil
+import threading
 import uuid
 import os
+import json
 import base64
-from process_pipeline import run_pipeline
+from pydantic import BaseModel
+import numpy as np
+from process_pipeline import run_pipeline, pipeline_fingerprint, REGION_TOP_K
+from utils.archive_utils import ArchiveProgress, QueueReader, StreamInterrupted, iter_archive_members
+from utils.retention_utils import RetentionManager, RetentionPolicy, touch_entry
+from utils.cache_utils import ResultCache
+from utils.inference_utils import rethreshold_maps
+from utils.region_utils import extract_regions
+from utils.visual_index import VISUAL_INDEX_DIR, get_visual_index, index_key
+from utils.tile_utils import get_tile_aggregator
+from utils.torch_utils import COMPILE_CACHE_DIR
 import uvicorn
 
 app = FastAPI(title="Anomaly Detection API")
@@ -25,16 +44,395 @@ UPLOAD_DIR.mkdir(exist_ok=True)
 OUTPUT_DIR = Path("inference_outputs")
 OUTPUT_DIR.mkdir(exist_ok=True)
 
+ARCHIVE_STATUS_DIR = Path("archive_status")
+ARCHIVE_STATUS_DIR.mkdir(exist_ok=True)
+
+# Frames extracted from an archive go through run_pipeline in batches of this size
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "8"))
+# Runs archive batches in the background while extraction keeps reading the upload
+archive_executor = ThreadPoolExecutor(max_workers=1)
+
+# Identical frames return the stored result instead of re-running the pipeline
+result_cache = ResultCache(Path("result_cache"), pipeline_fingerprint())
+
+def env_bytes(name: str) -> Optional[int]:
+    """Read an optional size quota given in GB from the environment."""
+    value = os.getenv(name)
+    return int(float(value) * 1024 ** 3) if value else None
+
+def env_seconds(name: str) -> Optional[float]:
+    """Read an optional age quota given in hours from the environment."""
+    value = os.getenv(name)
+    return float(value) * 3600 if value else None
+
+# Background eviction of old uploads, outputs and scratch space
+retention_manager = RetentionManager([
+    RetentionPolicy(UPLOAD_DIR, max_bytes=env_bytes("RETENTION_UPLOADS_MAX_GB"),
+                    max_age_s=env_seconds("RETENTION_UPLOADS_MAX_AGE_H"), keep_summaries=False),
+    RetentionPolicy(OUTPUT_DIR, max_bytes=env_bytes("RETENTION_OUTPUTS_MAX_GB"),
+                    max_age_s=env_seconds("RETENTION_OUTPUTS_MAX_AGE_H"),
+                    compact=os.getenv("RETENTION_COMPACT_OUTPUTS", "0") == "1"),
+    RetentionPolicy(Path("temp_processing"), max_age_s=env_seconds("RETENTION_TEMP_MAX_AGE_H") or 3600,
+                    keep_summaries=False),
+    # Caches and bookkeeping: losing an entry only costs a recomputation or a resume
+    RetentionPolicy(result_cache.cache_dir, max_bytes=env_bytes("RETENTION_CACHE_MAX_GB"),
+                    max_age_s=env_seconds("RETENTION_CACHE_MAX_AGE_H") or 7 * 24 * 3600, keep_summaries=False),
+    # The visual index cannot be rebuilt (crops are not kept), so it is only capped on request;
+    # each shard is one directory, evicted as a unit
+    RetentionPolicy(VISUAL_INDEX_DIR, max_bytes=env_bytes("RETENTION_VISUAL_INDEX_MAX_GB"), keep_summaries=False),
+    RetentionPolicy(ARCHIVE_STATUS_DIR, max_age_s=env_seconds("RETENTION_ARCHIVE_STATUS_MAX_AGE_H") or 7 * 24 * 3600,
+                    keep_summaries=False),
+    RetentionPolicy(COMPILE_CACHE_DIR, max_bytes=env_bytes("RETENTION_COMPILE_CACHE_MAX_GB") or 2 * 1024 ** 3,
+                    keep_summaries=False),
+], interval_s=float(os.getenv("RETENTION_INTERVAL_S", "300")))
+
+@app.on_event("startup")
+def start_retention_manager():
+    retention_manager.start()
+
+@app.on_event("startup")
+def load_tiles():
+    # Detections from earlier runs and offline batches; new ones are added by run_pipeline
+    threading.Thread(target=get_tile_aggregator().load_directory, args=(OUTPUT_DIR,), daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_retention_manager():
+    retention_manager.stop()
+
+@app.get("/metrics/retention")
+async def retention_metrics():
+    """Bytes reclaimed and current usage per managed directory."""
+    return retention_manager.snapshot()
+
+@app.get("/metrics/cache")
+async def cache_metrics():
+    """Hit, miss and coalesced-request counts of the result cache."""
+    return {"hits": result_cache.hits, "misses": result_cache.misses, "coalesced": result_cache.coalesced}
+
+class ArtifactFiles(StaticFiles):
+    """Static files restricted to rendered PNGs under <run>/images/; pickles, maps and summaries stay private."""
+
+    async def get_response(self, path: str, scope):
+        parts = Path(path).parts
+        if "images" not in parts[:-1] or Path(path).suffix.lower() != ".png":
+            raise HTTPException(status_code=404, detail="Not Found")
+        return await super().get_response(path, scope)
+
+# Rendered artifacts are served by URL to streaming clients instead of inlined as base64
+app.mount("/outputs", ArtifactFiles(directory=OUTPUT_DIR), name="outputs")
+
 def encode_image_to_base64(image_path: Path) -> str:
     """Convert image to base64 string."""
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode("utf-8")
 
+def artifact_url(path: str) -> str:
+    """Map an artifact path under OUTPUT_DIR to its /outputs URL."""
+    return "/outputs/" + Path(path).relative_to(OUTPUT_DIR).as_posix()
+
+def format_sse(event: str, data: dict) -> str:
+    """Format a Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def save_upload(uploaded_file: UploadFile) -> Path:
+    """Store an upload under a unique filename in UPLOAD_DIR."""
+    file_extension = os.path.splitext(uploaded_file.filename)[1]
+    file_path = UPLOAD_DIR / f"{uuid.uuid4()}{file_extension}"
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(uploaded_file.file, buffer)
+    return file_path
+
+@app.post("/upload_images/stream")
+async def upload_images_stream(files: List[UploadFile] = File(...)):
+    """
+    Upload a batch of frames and stream per-frame results as Server-Sent Events.
+    Events, tagged with frame_id: accepted, score, artifacts, annotation, indexed, and finally done.
+    """
+    file_paths = [save_upload(f) for f in files]
+    batch_id = str(uuid.uuid4())
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+
+    def on_event(stage: str, payload: dict):
+        if stage == "artifacts":
+            payload = {
+                **payload,
+                "mask_url": artifact_url(payload.pop("mask_path")),
+                "heat_map_url": artifact_url(payload.pop("heat_map_path")),
+                "image_url": artifact_url(payload.pop("image_path")),
+            }
+        loop.call_soon_threadsafe(events.put_nowait, (stage, payload))
+
+    def run():
+        try:
+            run_pipeline(file_paths, str(OUTPUT_DIR / batch_id), on_event=on_event)
+            on_event("done", {"batch_id": batch_id})
+        except Exception as e:
+            on_event("error", {"batch_id": batch_id, "error": str(e)})
+
+    async def event_stream():
+        yield format_sse("accepted", {
+            "batch_id": batch_id,
+            "frames": [{"frame_id": p.stem, "filename": f.filename} for p, f in zip(file_paths, files)]
+        })
+        task = loop.run_in_executor(None, run)
+        while True:
+            stage, payload = await events.get()
+            yield format_sse(stage, payload)
+            if stage in ("done", "error"):
+                break
+        await task
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def member_filename(member_name: str) -> str:
+    """Flatten an archive member path into a safe, unique frame filename."""
+    return re.sub(r"[^A-Za-z0-9._-]", "_", member_name.strip("/").replace("/", "__"))
+
+def ingest_archive(reader: QueueReader, archive_format: str, upload_id: str, progress: ArchiveProgress):
+    """Extract image members as they stream in and feed them to run_pipeline in batches."""
+    frame_dir = UPLOAD_DIR / upload_id
+    frame_dir.mkdir(parents=True, exist_ok=True)
+    output_dir = str(OUTPUT_DIR / upload_id)
+    futures = []
+    batch = []
+
+    def process_batch(members):
+        try:
+            results = run_pipeline([path for _, path in members], output_dir)
+            done = {r["json_summary"]["id"] for r in results}
+            for name, path in members:
+                progress.mark(name, "processed" if path.stem in done else "failed")
+        except Exception as e:
+            for name, _ in members:
+                progress.mark(name, "failed", error=str(e))
+
+    def flush():
+        if batch:
+            futures.append(archive_executor.submit(process_batch, list(batch)))
+            batch.clear()
+
+    try:
+        for name, data in iter_archive_members(reader, archive_format):
+            if progress.is_processed(name):
+                continue
+            frame_path = frame_dir / member_filename(name)
+            with open(frame_path, "wb") as f:
+                f.write(data)
+            progress.mark(name, "extracted", frame_id=frame_path.stem)
+            batch.append((name, frame_path))
+            if len(batch) >= ARCHIVE_BATCH_SIZE:
+                flush()
+    finally:
+        # Frames that arrived before a dropped connection are still processed
+        flush()
+        for future in futures:
+            future.result()
+
+@app.post("/upload_archive")
+async def upload_archive(request: Request, archive_format: str = "tar", upload_id: Optional[str] = None):
+    """
+    Stream a zip or tar archive of a flight as the raw request body.
+    Members are extracted on the fly and processed in batches as they arrive.
+    Re-sending the archive with the same upload_id skips members already processed.
+    """
+    if archive_format not in ("zip", "tar"):
+        raise HTTPException(status_code=400, detail="archive_format must be 'zip' or 'tar'")
+    upload_id = upload_id or str(uuid.uuid4())
+    if not re.fullmatch(r"[A-Za-z0-9_-]+", upload_id):
+        raise HTTPException(status_code=400, detail="Invalid upload_id")
+
+    progress = ArchiveProgress(ARCHIVE_STATUS_DIR / f"{upload_id}.jsonl")
+    chunks: queue.Queue = queue.Queue(maxsize=64)
+    loop = asyncio.get_running_loop()
+    extraction = loop.run_in_executor(None, ingest_archive, QueueReader(chunks), archive_format, upload_id, progress)
+
+    async def feed(item):
+        # Wait for room in the bounded queue, unless extraction already stopped reading
+        while not extraction.done():
+            try:
+                chunks.put_nowait(item)
+                return
+            except queue.Full:
+                await asyncio.sleep(0.01)
+
+    def abort(error: BaseException):
+        # No awaiting here (the request may be cancelled): make room if needed so the reader sees the error
+        while not extraction.done():
+            try:
+                chunks.put_nowait(error)
+                return
+            except queue.Full:
+                try:
+                    chunks.get_nowait()
+                except queue.Empty:
+                    pass
+
+    interrupted = None
+    ended = False
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                await feed(chunk)
+        await feed(None)
+        ended = True
+    except Exception as e:
+        interrupted = e
+    finally:
+        # Also on cancellation (a BaseException), so extraction stops waiting for chunks
+        # and the frames extracted so far are still processed
+        if not ended:
+            abort(interrupted or StreamInterrupted("Upload cancelled"))
+
+    try:
+        await extraction
+    except Exception as e:
+        interrupted = interrupted or e
+
+    return {
+        "upload_id": upload_id,
+        "complete": interrupted is None,
+        "error": str(interrupted) if interrupted else None,
+        "counts": progress.counts(),
+        "members": progress.members
+    }
+
+@app.get("/upload_archive/{upload_id}")
+async def archive_status(upload_id: str):
+    """Return per-member status of an archive upload so a client can resume it."""
+    status_path = ARCHIVE_STATUS_DIR / f"{upload_id}.jsonl"
+    if not re.fullmatch(r"[A-Za-z0-9_-]+", upload_id) or not status_path.exists():
+        raise HTTPException(status_code=404, detail="Unknown upload_id")
+    progress = ArchiveProgress(status_path)
+    return {"upload_id": upload_id, "counts": progress.counts(), "members": progress.members}
+
+async def score_upload(file_path: Path) -> dict:
+    """Score-only fast path for /upload_image, reusing a full cached result when one exists."""
+    cached = result_cache.get(result_cache.key_for(file_path))
+    if cached:
+        file_path.unlink(missing_ok=True)
+        summary = cached["json_summary"]
+    else:
+        results = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: run_pipeline(file_path, str(OUTPUT_DIR / file_path.name), score_only=True)
+        )
+        if not results:
+            return {"error": "No results generated from pipeline", "filename": file_path.name}
+        summary = results[0]["json_summary"]
+    return {
+        "message": "File scored successfully",
+        "filename": file_path.name,
+        "cached": cached is not None,
+        "detection": {k: summary.get(k) for k in ("id", "latitude", "longitude", "pred_score", "pred_label", "regions")}
+    }
+
+class RethresholdRequest(BaseModel):
+    pixel_threshold: float = 0.5
+    image_threshold: float = 0.5
+    count_regions: bool = False
+
+# Anomaly maps are re-evaluated this many frames at a time to bound memory
+RETHRESHOLD_CHUNK = int(os.getenv("RETHRESHOLD_CHUNK", "256"))
+
+def rethreshold_frames(mission_dir: Path, request: RethresholdRequest) -> List[dict]:
+    """Re-evaluate the stored anomaly maps of a mission chunk by chunk."""
+    frames = []
+    map_paths = [p for p in sorted((mission_dir / "anomaly_maps").glob("*.npy"))
+                 if (mission_dir / "json" / f"{p.stem}_summary.json").exists()]
+    for start in range(0, len(map_paths), RETHRESHOLD_CHUNK):
+        chunk = map_paths[start:start + RETHRESHOLD_CHUNK]
+        scores = []
+        for map_path in chunk:
+            with open(mission_dir / "json" / f"{map_path.stem}_summary.json", "r") as f:
+                scores.append(json.load(f)["pred_score"])
+        maps = np.stack([np.load(map_path) for map_path in chunk]).astype(np.float32)
+        evaluated = rethreshold_maps(maps, np.asarray(scores, dtype=np.float32),
+                                     request.pixel_threshold, request.image_threshold)
+        for i, map_path in enumerate(chunk):
+            frame = {
+                "id": map_path.stem,
+                "pred_score": scores[i],
+                "pred_label": int(evaluated["pred_label"][i]),
+                "anomalous_area_fraction": float(evaluated["anomalous_area_fraction"][i]),
+                "peak_score": float(evaluated["peak_score"][i]),
+                "mean_region_score": float(evaluated["mean_region_score"][i])
+            }
+            if request.count_regions:
+                frame["regions"] = extract_regions(maps[i], evaluated["masks"][i], top_k=REGION_TOP_K)
+            frames.append(frame)
+        del maps, evaluated
+    return frames
+
+@app.post("/missions/{mission_id}/rethreshold")
+async def rethreshold_mission(mission_id: str, request: RethresholdRequest):
+    """
+    Re-evaluate every stored anomaly map of a mission against new pixel/image thresholds
+    in vectorized chunks, without re-running the model. Thresholds are on the
+    normalized scale, where the trained thresholds sit at 0.5.
+    """
+    mission_dir = OUTPUT_DIR / mission_id
+    if (not re.fullmatch(r"[A-Za-z0-9._-]+", mission_id) or not mission_id.strip(".")
+            or not (mission_dir / "anomaly_maps").is_dir()):
+        raise HTTPException(status_code=404, detail="Unknown mission or no stored anomaly maps")
+
+    frames = await asyncio.get_running_loop().run_in_executor(None, rethreshold_frames, mission_dir, request)
+    if not frames:
+        raise HTTPException(status_code=404, detail="No stored anomaly maps")
+
+    return {
+        "mission_id": mission_id,
+        "pixel_threshold": request.pixel_threshold,
+        "image_threshold": request.image_threshold,
+        "anomalous_frames": sum(frame["pred_label"] for frame in frames),
+        "frames": frames
+    }
+
+@app.get("/similar/{detection_id:path}")
+async def similar_detections(detection_id: str, box_id: int = 1, k: int = 10):
+    """
+    Detections whose anomaly crops look like this one, by local CLIP image embeddings.
+    detection_id is the summary's "<run>/<frame>" detection_id.
+    """
+    index = get_visual_index()
+    query = index.vector(index_key(detection_id, box_id))
+    if query is None:
+        raise HTTPException(status_code=404, detail="No visual embedding for this detection")
+    matches = index.search(query, k=k, exclude_prefix=f"{detection_id}:")
+    return {
+        "detection_id": detection_id,
+        "box_id": box_id,
+        "matches": [
+            {"detection_id": key.rsplit(":", 1)[0], "box_id": int(key.rsplit(":", 1)[1]), "similarity": score}
+            for key, score in matches
+        ]
+    }
+
+@app.get("/tiles/{z}/{x}/{y}")
+async def get_tile(z: int, x: int, y: int, request: Request):
+    """
+    Clustered detections inside one Web Mercator tile: per cluster the centroid, count,
+    anomalous count, max score and max person/animal confidence.
+    """
+    if z < 0 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=404, detail="Tile out of range")
+    aggregator = get_tile_aggregator()
+    payload, version = aggregator.tile(z, x, y)
+    etag = f'"{aggregator.epoch}-{z}-{x}-{y}-{version}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=30, stale-while-revalidate=300"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=json.dumps(payload, separators=(",", ":")), media_type="application/json", headers=headers)
+
 @app.post("/upload_image")
-async def upload_image(file: UploadFile = File(None), image: UploadFile = File(None)):
+async def upload_image(file: UploadFile = File(None), image: UploadFile = File(None), score_only: bool = False):
     """
     Upload an image file for anomaly detection and analysis.
     Accepts either 'file' or 'image' as the field name.
+    With ?score_only=true only scores and region statistics are returned (no renders or LLM).
     """
     try:
         # Get the uploaded file (either from 'file' or 'image' field)
@@ -42,27 +440,37 @@ async def upload_image(file: UploadFile = File(None), image: UploadFile = File(N
         if not uploaded_file:
             return {"error": "No file uploaded"}
         print(f"🔍 Uploading image: {uploaded_file.filename}")
-        # Generate a unique filename
-        file_extension = os.path.splitext(uploaded_file.filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = UPLOAD_DIR / unique_filename
-
-        # Save the uploaded file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(uploaded_file.file, buffer)
-
-        # Process the image through the pipeline
-        print(f"Processing image: {file_path}")
-        results = run_pipeline(file_path, str(OUTPUT_DIR / unique_filename))
-        
-        if not results:
+        # Save the uploaded file under a unique filename
+        file_path = save_upload(uploaded_file)
+        unique_filename = file_path.name
+
+        if score_only:
+            return await score_upload(file_path)
+
+        def process():
+            # Process the image through the pipeline
+            print(f"Processing image: {file_path}")
+            results = run_pipeline(file_path, str(OUTPUT_DIR / unique_filename))
+            # Get the first result (since we're processing one image)
+            return results[0] if results else None
+
+        # Identical content (retries, duplicate uploads) is served from the cache;
+        # concurrent uploads of the same frame share one pipeline run
+        cache_key = result_cache.key_for(file_path)
+        result, cached = await asyncio.get_running_loop().run_in_executor(
+            None, result_cache.get_or_compute, cache_key, process
+        )
+
+        if not result:
             return {
                 "error": "No results generated from pipeline",
                 "filename": unique_filename
             }
-            
-        # Get the first result (since we're processing one image)
-        result = results[0]
+
+        if cached:
+            print(f"♻️ Serving cached result for {uploaded_file.filename}")
+            file_path.unlink(missing_ok=True)
+            touch_entry(Path(result["json_path"]).parents[1])
         
         # Encode images as base64
         mask_base64 = encode_image_to_base64(Path(result["mask_path"]))
@@ -72,6 +480,7 @@ async def upload_image(file: UploadFile = File(None), image: UploadFile = File(N
         return {
             "message": "File processed successfully",
             "filename": unique_filename,
+            "cached": cached,
             "detection": result["json_summary"],
             "images": {
                 "marked": f"data:image/png;base64,{mask_base64}",
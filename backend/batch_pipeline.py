@@ -0,0 +1,143 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+# Offline batch runner for whole mission directories.
+#
+# The directory is split into chunks of frames, and chunks are spread over worker
+# processes. Each worker loads the model once, runs with its own thread budget and
+# writes results straight into the output directory. Finished frames are appended
+# to progress.jsonl, so a rerun skips them.
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".tif", ".tiff"}
+PROGRESS_FILE = "progress.jsonl"
+OUTPUT_ROOT = Path("inference_outputs")
+
+_pipeline_fn: Optional[Callable] = None
+
+
+def default_output_dir(image_dir: str, output_dir: Optional[str] = None) -> Path:
+    """One mission folder under the server's inference_outputs/, like the API's per-upload folders."""
+    return Path(output_dir) if output_dir else OUTPUT_ROOT / Path(image_dir).resolve().name
+
+
+def list_images(image_dir: Path) -> List[Path]:
+    return sorted(p for p in image_dir.iterdir() if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+def load_finished(output_dir: Path) -> set:
+    """Frames recorded as done in a previous run."""
+    finished = set()
+    progress_path = output_dir / PROGRESS_FILE
+    if progress_path.exists():
+        with open(progress_path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # partial line from an interrupted run
+                if entry.get("status") == "done":
+                    finished.add(entry["frame"])
+    return finished
+
+
+def init_worker(threads: int):
+    """Pin the thread budget before torch is imported, then load the model once per process.
+
+    Workers append their own shards to the shared visual index, where the server finds them.
+    """
+    global _pipeline_fn
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "INFERENCE_THREADS"):
+        os.environ[var] = str(threads)
+    import torch
+    torch.set_num_threads(threads)
+    from process_pipeline import run_pipeline
+    _pipeline_fn = run_pipeline
+
+
+def process_chunk(args):
+    """Run one chunk of frames through the pipeline; never raises so the pool keeps going."""
+    image_paths, output_dir, score_only = args
+    start = time.perf_counter()
+    try:
+        results = _pipeline_fn(image_paths, output_dir, score_only=score_only)
+        done = {r["json_summary"]["id"] for r in results}
+        error = None
+    except Exception as e:
+        done, error = set(), str(e)
+    statuses = [{"frame": p.name, "status": "done" if p.stem in done else "failed", "error": error}
+                for p in image_paths]
+    return statuses, time.perf_counter() - start
+
+
+def run_batch(image_dir: Path, output_dir: Path, workers: int = 1, threads_per_worker: int = 1,
+              chunk_size: int = 8, score_only: bool = False, pipeline_fn: Optional[Callable] = None):
+    """Process every image in image_dir, skipping frames finished by earlier runs."""
+    global _pipeline_fn
+    output_dir.mkdir(parents=True, exist_ok=True)
+    finished = load_finished(output_dir)
+    images = [p for p in list_images(image_dir) if p.name not in finished]
+    print(f"🔍 {len(images)} frame(s) to process ({len(finished)} already done) "
+          f"with {workers} worker(s) x {threads_per_worker} thread(s)")
+    if not images:
+        return
+
+    chunks = [(images[i:i + chunk_size], str(output_dir), score_only) for i in range(0, len(images), chunk_size)]
+    processed = failed = 0
+    start = time.perf_counter()
+
+    with open(output_dir / PROGRESS_FILE, "a") as progress:
+        def record(statuses):
+            nonlocal processed, failed
+            for entry in statuses:
+                progress.write(json.dumps(entry) + "\n")
+                processed += entry["status"] == "done"
+                failed += entry["status"] == "failed"
+            progress.flush()
+            elapsed = time.perf_counter() - start
+            print(f"📈 {processed + failed}/{len(images)} frames, {failed} failed, "
+                  f"{processed / elapsed:.2f} frames/s")
+
+        if workers <= 1:
+            if pipeline_fn is not None:
+                _pipeline_fn = pipeline_fn
+            else:
+                init_worker(threads_per_worker)
+            for chunk in chunks:
+                statuses, _ = process_chunk(chunk)
+                record(statuses)
+        else:
+            # spawn: each worker gets a clean interpreter and its own resident model
+            context = multiprocessing.get_context("spawn")
+            with context.Pool(workers, initializer=init_worker, initargs=(threads_per_worker,)) as pool:
+                for statuses, _ in pool.imap_unordered(process_chunk, chunks):
+                    record(statuses)
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ Processed {processed} frame(s), {failed} failed, in {elapsed:.1f}s "
+          f"({processed / elapsed:.2f} frames/s)")
+
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="Run the pipeline over all drone images in a directory")
+    parser.add_argument("--image_dir", type=str, required=True, help="Directory containing drone images")
+    parser.add_argument("--output_dir", type=str, default=None,
+                        help="Directory to save results (default: inference_outputs/<image_dir name>)")
+    parser.add_argument("--threads_per_worker", type=int, default=2, help="Torch threads per worker process")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: cores / threads)")
+    parser.add_argument("--chunk_size", type=int, default=8, help="Frames per pipeline run")
+    parser.add_argument("--score_only", action="store_true", help="Skip renders, LLM annotation and embeddings")
+    args = parser.parse_args()
+
+    workers = args.workers or max(cpu_count // args.threads_per_worker, 1)
+    run_batch(Path(args.image_dir), default_output_dir(args.image_dir, args.output_dir), workers=workers,
+              threads_per_worker=args.threads_per_worker, chunk_size=args.chunk_size, score_only=args.score_only)
+
+
+if __name__ == "__main__":
+    main()
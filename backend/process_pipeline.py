@@ -1,14 +1,25 @@
 from pathlib import Path
+from typing import Callable, List, Optional, Union
+import os
 import json
+import hashlib
 import shutil
-from utils.inference_utils import save_prediction_outputs
-from utils.exif_utils import extract_gps_from_exif_or_generate
-from utils.llm_utils import annotate_picture, get_embedding_from_annotation
-from anomalib.engine import Engine
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.inference_utils import save_prediction_outputs, save_score_outputs, result_to_arrays, result_to_maps
+from utils.exif_utils import extract_gps
+from utils.llm_utils import get_embedding_from_annotation, ANNOTATION_BATCH_SIZE
+from utils.predict_utils import stream_predict
+from utils.annotators import get_annotator, ANNOTATOR_BACKEND
+from utils.visual_index import embed_detections
+from utils.tile_utils import get_tile_aggregator
+from utils.region_utils import encode_region_crops, extract_regions, crop_region
+from utils.dedup_utils import DetectionDeduplicator, dhash, project_region, region_key
+from utils.torch_utils import OPTIMIZED_INFERENCE, INFERENCE_BF16, bf16_supported, optimize_patchcore_for_cpu
 from anomalib.models import Patchcore
 from anomalib.data import PredictDataset
 
-engine = Engine()
 model = Patchcore(
     backbone="resnet18",
     layers=["layer2", "layer3"],
@@ -16,84 +27,334 @@ model = Patchcore(
     coreset_sampling_ratio=0.1,
     num_neighbors=9,
 )
+if OPTIMIZED_INFERENCE:
+    optimize_patchcore_for_cpu(model)
 
 checkpoint_path = Path(__file__).parent / "patchcore/drone/v25/weights/lightning/model.ckpt"
 print(f"🔍 Loading checkpoint from {checkpoint_path}")
 
-def run_pipeline(image_path: Path, output_dir: str):
-    """Process a single image through the anomaly detection pipeline."""
-    if not image_path.exists():
-        raise FileNotFoundError(f"Image not found: {image_path}")
+# Only the top-k anomaly regions are cropped and sent to the LLM
+REGION_TOP_K = 3
+REGION_PADDING = 0.5
+
+def pipeline_fingerprint() -> str:
+    """Identify the checkpoint (and the thresholds stored in it) plus the settings that shape results."""
+    stat = checkpoint_path.stat() if checkpoint_path.exists() else None
+    settings = {
+        "checkpoint": str(checkpoint_path),
+        "checkpoint_size": stat.st_size if stat else None,
+        "checkpoint_mtime": stat.st_mtime if stat else None,
+        "image_size": [320, 256],
+        "region_top_k": REGION_TOP_K,
+        "region_padding": REGION_PADDING,
+        # bfloat16 features shift scores slightly, so keep those results apart
+        # (only when bf16 actually runs: it is skipped on CPUs without native support)
+        "bf16": OPTIMIZED_INFERENCE and INFERENCE_BF16 and bf16_supported(),
+        "annotator": ANNOTATOR_BACKEND,
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+# Shared across requests so repeated sightings from overlapping frames join one track
+deduplicator = DetectionDeduplicator()
+
+# The shared model gets its checkpoint reloaded by every predict, so only one predict runs at a time
+predict_lock = threading.Lock()
+
+# on_event(stage, payload) is called as each stage of a frame completes
+EventCallback = Callable[[str, dict], None]
+
+def run_pipeline(image_path: Union[Path, List[Path]], output_dir: str, on_event: Optional[EventCallback] = None,
+                 score_only: bool = False):
+    """Process one image, or a batch of images, through the anomaly detection pipeline.
+
+    With score_only, stop after scores and region statistics: no renders, LLM or embeddings.
+    """
+    image_paths = image_path if isinstance(image_path, list) else [image_path]
+    for path in image_paths:
+        if not path.exists():
+            raise FileNotFoundError(f"Image not found: {path}")
+    emit = on_event or (lambda stage, payload: None)
     
-    # Create a temporary directory for the single image
-    temp_dir = Path("temp_processing")
-    temp_dir.mkdir(exist_ok=True)
+    # Create a private temporary directory for this run's images
+    Path("temp_processing").mkdir(exist_ok=True)
+    temp_dir = Path(tempfile.mkdtemp(dir="temp_processing"))
     
     try:
-        # Copy the image to the temp directory
-        temp_image_path = temp_dir / image_path.name
-        shutil.copy2(image_path, temp_image_path)
+        # Copy the images to the temp directory
+        for path in image_paths:
+            shutil.copy2(path, temp_dir / path.name)
         
-        # Create dataset with just this image
+        # Create dataset with just these images
         dataset = PredictDataset(path=temp_dir, image_size=(320, 256))
         output_dir = Path(output_dir)
         output_dir.mkdir(parents=True, exist_ok=True)
 
         print("🔍 Running anomaly detection...")
-        print(f"🔍 Running anomaly detection on image: {image_path.name}")
+        print(f"🔍 Running anomaly detection on {len(image_paths)} image(s): {', '.join(p.name for p in image_paths[:5])}")
         
         if not checkpoint_path.exists():
             raise FileNotFoundError("Checkpoint not found")
         print(f"🔍 Loading checkpoint from {checkpoint_path}")
-        results = engine.predict(model=model, dataset=dataset, ckpt_path=checkpoint_path)
-        print("💾 Saving inference results...")
-        
         processed_results = []
-        for result in results:
-            label = save_prediction_outputs(result, output_dir)
-
-            filename_stem = Path(result.image_path[0]).stem
-            mask_path = output_dir / "images" / filename_stem / f"{filename_stem}_mask.png"
-            heat_map_path = output_dir / "images" / filename_stem / f"{filename_stem}_heatmap.png"
-            image_path = output_dir / "images" / filename_stem / f"{filename_stem}_image.png"
-            json_path = output_dir / "json" / f"{filename_stem}_summary.json"
-            lat, lon = extract_gps_from_exif_or_generate(result.image_path[0])
-
-            with open(json_path, "r") as f:
-                summary = json.load(f)
-            summary = {"id": filename_stem, "latitude": lat, "longitude": lon, **summary}
-
-            if label == 1:
-                print(f"🧠 Annotating {filename_stem}_mask.png with LLM...")
-                annotation = annotate_picture(str(mask_path))
-                if annotation:
-                    embedding = get_embedding_from_annotation(annotation)
-                    
-                    summary["annotation"] = annotation
-                    summary["embedding"] = embedding
-
-            with open(json_path, "w") as f:
-                json.dump(summary, f, indent=2)
-
-            print(f"✅ Annotation, GPS, and embedding saved to {json_path}")
-            
-            processed_results.append({
-                "mask_path": str(mask_path),
-                "heat_map_path": str(heat_map_path),
-                "image_path": str(image_path),
-                "json_summary": summary
-            })
-    
+        pending = []
+        windows = []
+        # Annotation windows (LLM, embeddings) run beside prediction in order, so the consumer
+        # keeps draining predictions and predict_lock is only held for inference
+        with ThreadPoolExecutor(max_workers=1) as annotation_executor:
+            # Results arrive one batch at a time; tensors are released once each frame is saved
+            for result in stream_predict(model, dataset, checkpoint_path, lock=predict_lock):
+                # Scores are known before any rendering, so report them first
+                emit("score", {
+                    "frame_id": Path(result.image_path[0]).stem,
+                    "pred_score": float(result.pred_score.item()),
+                    "pred_label": int(result.pred_label.item())
+                })
+                if score_only:
+                    processed_results.append(save_score_result(result, output_dir))
+                else:
+                    pending.append(save_frame(result, output_dir, emit))
+                del result
+
+                # Annotate in windows so the first annotations don't wait for the whole dataset
+                if sum(r["label"] == 1 for r in pending) >= ANNOTATION_BATCH_SIZE:
+                    windows.append(annotation_executor.submit(annotate_and_index, pending, emit))
+                    pending = []
+
+            if pending:
+                windows.append(annotation_executor.submit(annotate_and_index, pending, emit))
+            for window in windows:
+                processed_results.extend(window.result())
         return processed_results
     finally:
         # Clean up temporary directory
         shutil.rmtree(temp_dir, ignore_errors=True)
 
 
+def detection_id(output_dir: Path, filename_stem: str) -> str:
+    """Identify a frame across runs: stems like DJI_0001 repeat from mission to mission."""
+    return f"{Path(output_dir).name}/{filename_stem}"
+
+
+def save_frame(result, output_dir: Path, emit: EventCallback) -> dict:
+    """Save one predicted frame: renders, summary, regions and their dedup tracks."""
+    label = save_prediction_outputs(result, output_dir)
+
+    filename_stem = Path(result.image_path[0]).stem
+    mask_path = output_dir / "images" / filename_stem / f"{filename_stem}_mask.png"
+    heat_map_path = output_dir / "images" / filename_stem / f"{filename_stem}_heatmap.png"
+    image_path = output_dir / "images" / filename_stem / f"{filename_stem}_image.png"
+    json_path = output_dir / "json" / f"{filename_stem}_summary.json"
+    lat, lon, synthetic_gps = extract_gps(result.image_path[0])
+
+    with open(json_path, "r") as f:
+        summary = json.load(f)
+    summary = {"id": filename_stem, "detection_id": detection_id(output_dir, filename_stem),
+               "latitude": lat, "longitude": lon, "synthetic_gps": synthetic_gps, **summary}
+
+    image, anomaly_map, pred_mask = result_to_arrays(result)
+    regions = extract_regions(anomaly_map, pred_mask, top_k=REGION_TOP_K)
+    summary["regions"] = regions
+    # Crops are only needed for annotation and visual embeddings of anomalous frames
+    crops = encode_region_crops(image, regions, padding=REGION_PADDING) if label == 1 else []
+
+    # One track per region, so every warm object in a frame is deduplicated on its own.
+    # Random fallback coordinates would match unrelated frames, so those are never deduplicated.
+    tracks = {}
+    annotate_boxes = {r["box_id"] for r in regions} if label == 1 else set()
+    if label == 1 and not synthetic_gps:
+        for region in regions:
+            ground_lat, ground_lon = project_region(lat, lon, region["bbox"], image.shape[:2])
+            descriptor = dhash(crop_region(image, region, padding=0))
+            track, is_new_track = deduplicator.assign(summary["detection_id"], region["box_id"],
+                                                      ground_lat, ground_lon, descriptor)
+            region["track_id"] = track.track_id
+            tracks[region["box_id"]] = track
+            if not is_new_track:
+                annotate_boxes.discard(region["box_id"])
+
+    emit("artifacts", {
+        "frame_id": filename_stem,
+        "mask_path": str(mask_path),
+        "heat_map_path": str(heat_map_path),
+        "image_path": str(image_path),
+        "regions": regions
+    })
+    return {
+        "mask_path": str(mask_path),
+        "heat_map_path": str(heat_map_path),
+        "image_path": str(image_path),
+        "json_path": str(json_path),
+        "json_summary": summary,
+        "label": label,
+        "crops": crops,
+        "tracks": tracks,
+        "annotate_boxes": annotate_boxes
+    }
+
+
+def merge_annotation(fresh: Optional[dict], copied: List[dict], base: Optional[dict]) -> Optional[dict]:
+    """Combine a frame's own annotation with anomaly entries copied from matching tracks.
+
+    A frame whose regions were all copied takes its scene-level fields from base,
+    the annotation of one of its tracks' representative frames.
+    """
+    if not copied:
+        return fresh
+    copied_boxes = {a["box_id"] for a in copied}
+    own = [a for a in (fresh or {}).get("anomalies", []) if a.get("box_id") not in copied_boxes]
+    anomalies = sorted(own + copied, key=lambda a: a.get("box_id", 0))
+    counts: dict = {}
+    for anomaly in anomalies:
+        top = (anomaly.get("possible_objects") or ["other"])[0]
+        counts[top] = counts.get(top, 0) + 1
+    return {
+        **(fresh or base or {}),
+        "anomalies": anomalies,
+        "overall_objects_detected": [{"label": label, "count": count} for label, count in counts.items()]
+    }
+
+
+def annotate_and_index(processed_results: List[dict], emit: EventCallback) -> List[dict]:
+    """Embed, annotate and write the summaries of a window of saved frames."""
+    # Visual embeddings of every anomalous crop, independent of whether annotation succeeds
+    anomalous_crops = [(r["json_summary"]["detection_id"], r["crops"])
+                       for r in processed_results if r["label"] == 1 and r["crops"]]
+    if embed_detections(anomalous_crops):
+        for r in processed_results:
+            if r["label"] == 1 and r["crops"]:
+                r["json_summary"]["visual_embedding_boxes"] = [box_id for box_id, _ in r["crops"]]
+
+    # A track seen before without a usable annotation gets one more attempt from this run
+    pending_tracks = {r["tracks"][box_id].track_id for r in processed_results
+                      for box_id in r["annotate_boxes"] if box_id in r["tracks"]}
+    for r in processed_results:
+        for box_id, track in r["tracks"].items():
+            if box_id not in r["annotate_boxes"] and track.annotation is None and track.track_id not in pending_tracks:
+                r["annotate_boxes"].add(box_id)
+                track.representative = region_key(r["json_summary"]["detection_id"], box_id)
+                pending_tracks.add(track.track_id)
+
+    # Annotate only regions without an annotated track, packing several frames' crops into each LLM request
+    anomalous = [r for r in processed_results if r["label"] == 1]
+    to_batch = [(r["json_summary"]["id"], [(box_id, png) for box_id, png in r["crops"] if box_id in r["annotate_boxes"]])
+                for r in anomalous if r["crops"]]
+    to_batch = [(frame_id, crops) for frame_id, crops in to_batch if crops]
+    locations = {r["json_summary"]["id"]: {reg["box_id"]: reg["approximate_location"] for reg in r["json_summary"]["regions"]}
+                 for r in anomalous}
+    annotator = get_annotator()
+    if to_batch:
+        print(f"🧠 Annotating {sum(len(c) for _, c in to_batch)} region(s) of {len(to_batch)} frame(s) "
+              f"with the {annotator.name} annotator...")
+    annotations = annotator.annotate_frames(to_batch, locations)
+
+    fresh = {}
+    for r in anomalous:
+        summary = r["json_summary"]
+        if not r["crops"]:
+            print(f"🧠 Annotating {summary['id']}_mask.png with the {annotator.name} annotator...")
+            try:
+                fresh[summary["id"]] = annotator.annotate_picture(r["mask_path"])
+            except Exception as e:
+                # The frame's outputs are saved; it is only left unannotated
+                print(f"⚠️ Annotation failed for {summary['id']}: {e}")
+                fresh[summary["id"]] = None
+            continue
+        annotation = annotations.get(summary["id"])
+        fresh[summary["id"]] = annotation
+        # Each annotated region becomes its track's annotation
+        for anomaly in (annotation or {}).get("anomalies", []):
+            track = r["tracks"].get(anomaly.get("box_id"))
+            if track and anomaly["box_id"] in r["annotate_boxes"]:
+                track.annotation = anomaly
+                track.frame_annotation = annotation
+
+    # Regions matching an annotated track copy its entry, under this frame's box_id and location
+    for r in anomalous:
+        summary = r["json_summary"]
+        copied, sources, base = [], {}, None
+        for box_id, track in r["tracks"].items():
+            if box_id in r["annotate_boxes"] or track.annotation is None:
+                continue
+            copied.append({**track.annotation, "box_id": box_id,
+                           "approximate_location": locations[summary["id"]].get(box_id, "unknown")})
+            sources[box_id] = track.representative
+            base = base or track
+        annotation = merge_annotation(fresh.get(summary["id"]), copied, base.frame_annotation if base else None)
+        if not annotation:
+            continue
+
+        # Text embeddings still come from the OpenAI API; local-only deployments skip them.
+        # A frame made only of copied regions reuses the embedding of a representative frame.
+        if fresh.get(summary["id"]) is None and base is not None:
+            embedding = base.embedding
+        else:
+            try:
+                embedding = get_embedding_from_annotation(annotation) if os.getenv("OPENAI_API_KEY") else None
+            except Exception as e:
+                print(f"⚠️ Embedding failed for {summary['id']}: {e}")
+                embedding = None
+            for box_id in r["annotate_boxes"]:
+                if box_id in r["tracks"] and r["tracks"][box_id].annotation is not None:
+                    r["tracks"][box_id].embedding = embedding
+
+        summary["annotation"] = annotation
+        summary["embedding"] = embedding
+        event = {"frame_id": summary["id"], "annotation": annotation}
+        if sources:
+            # box_id -> "<detection_id>:<box_id>" of the region the annotation was copied from
+            summary["annotation_sources"] = sources
+            event["annotation_sources"] = sources
+        emit("annotation", event)
+
+    for r in processed_results:
+        summary = r["json_summary"]
+        with open(r["json_path"], "w") as f:
+            json.dump(summary, f, indent=2)
+
+        get_tile_aggregator().add(summary)
+        print(f"✅ Annotation, GPS, and embedding saved to {r['json_path']}")
+        emit("indexed", {"frame_id": summary["id"], "has_embedding": summary.get("embedding") is not None})
+        del r["label"], r["crops"], r["tracks"], r["annotate_boxes"]
+
+    return processed_results
+
+
+def save_score_result(result, output_dir: Path) -> dict:
+    """Score-only fast path: persist scores, region statistics and the anomaly map of one result."""
+    save_score_outputs(result, output_dir)
+
+    filename_stem = Path(result.image_path[0]).stem
+    json_path = output_dir / "json" / f"{filename_stem}_summary.json"
+    lat, lon, synthetic_gps = extract_gps(result.image_path[0])
+    anomaly_map, pred_mask = result_to_maps(result)
+
+    summary = {
+        "id": filename_stem,
+        "detection_id": detection_id(output_dir, filename_stem),
+        "latitude": lat,
+        "longitude": lon,
+        "synthetic_gps": synthetic_gps,
+        "pred_score": float(result.pred_score.item()),
+        "pred_label": int(result.pred_label.item()),
+        "regions": extract_regions(anomaly_map, pred_mask, top_k=REGION_TOP_K)
+    }
+    with open(json_path, "w") as f:
+        json.dump(summary, f, indent=2)
+    get_tile_aggregator().add(summary)
+
+    return {"json_path": str(json_path), "json_summary": summary}
+
+
 if __name__ == "__main__":
+    import argparse
+    from batch_pipeline import default_output_dir, run_batch
+
     parser = argparse.ArgumentParser(description="Run full pipeline on all drone images in a directory")
     parser.add_argument("--image_dir", type=str, required=True, help="Directory containing PNG images")
-    parser.add_argument("--output_dir", type=str, default="inference_outputs", help="Directory to save results")
+    parser.add_argument("--output_dir", type=str, default=None,
+                        help="Directory to save results (default: inference_outputs/<image_dir name>)")
+    parser.add_argument("--score_only", action="store_true", help="Skip renders, LLM annotation and embeddings")
     args = parser.parse_args()
 
-    run_pipeline(Path(args.image_dir), args.output_dir)
+    # Single process with the model already loaded here; use batch_pipeline.py to spread over all cores
+    run_batch(Path(args.image_dir), default_output_dir(args.image_dir, args.output_dir), score_only=args.score_only, pipeline_fn=run_pipeline)
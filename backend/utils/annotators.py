@@ -0,0 +1,152 @@
+import os
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from utils.llm_utils import AnalysisResult, annotate_frames, annotate_picture
+
+# ---- Pluggable annotation backends ----
+#
+# "remote"  - the LLM (gpt-4o-mini) via llm_utils, the original behaviour
+# "local"   - zero-shot CLIP on CPU over the anomaly crops, no network
+# "cascade" - local first; frames where a person or animal scores above
+#             CASCADE_THRESHOLD are re-annotated by the remote LLM
+
+# (frame_id, [(box_id, PNG bytes), ...])
+FrameCrops = Tuple[str, List[Tuple[int, bytes]]]
+
+ANNOTATOR_BACKEND = os.getenv("ANNOTATOR_BACKEND", "remote")
+CASCADE_THRESHOLD = float(os.getenv("CASCADE_THRESHOLD", "0.3"))
+
+# Label set of the LLM prompt's possible_objects
+LABELS = ("person", "animal", "logs", "debris", "vehicle", "tree", "other")
+LABEL_PROMPTS = (
+    "a top-down thermal drone image of a person",
+    "a top-down thermal drone image of an animal",
+    "a top-down thermal drone image of logs",
+    "a top-down thermal drone image of debris",
+    "a top-down thermal drone image of a vehicle",
+    "a top-down thermal drone image of a tree",
+    "a top-down thermal drone image of the ground",
+)
+PRIORITY_LABELS = ("person", "animal")
+
+
+class Annotator(ABC):
+    """Turns anomaly crops into AnalysisResult annotations."""
+
+    name = "base"
+
+    @abstractmethod
+    def annotate_frames(self, frames: List[FrameCrops],
+                        locations: Optional[Dict[str, Dict[int, str]]] = None) -> Dict[str, Optional[AnalysisResult]]:
+        """Annotate the crops of several frames, keyed by frame_id."""
+
+    @abstractmethod
+    def annotate_picture(self, image_path: str) -> Optional[AnalysisResult]:
+        """Annotate a full frame when no region crop is available."""
+
+
+class RemoteLLMAnnotator(Annotator):
+    name = "remote"
+
+    def annotate_frames(self, frames, locations=None):
+        return annotate_frames(frames)
+
+    def annotate_picture(self, image_path):
+        return annotate_picture(image_path)
+
+
+class ClipAnnotator(Annotator):
+    """Zero-shot CLIP over all crops of a batch of frames in one forward pass."""
+
+    name = "local"
+
+    def annotate_frames(self, frames, locations=None):
+        from utils.clip_utils import zero_shot
+
+        locations = locations or {}
+        flat = [(frame_id, box_id, png) for frame_id, crops in frames for box_id, png in crops]
+        probabilities = zero_shot([png for _, _, png in flat], LABEL_PROMPTS)
+
+        per_frame: Dict[str, list] = {frame_id: [] for frame_id, _ in frames}
+        for (frame_id, box_id, _), probs in zip(flat, probabilities):
+            per_frame[frame_id].append((box_id, probs))
+
+        return {
+            frame_id: self.build_result(boxes, locations.get(frame_id, {}))
+            for frame_id, boxes in per_frame.items() if boxes
+        }
+
+    def annotate_picture(self, image_path):
+        with open(image_path, "rb") as f:
+            return self.annotate_frames([("frame", [(1, f.read())])])["frame"]
+
+    @staticmethod
+    def build_result(boxes, locations: Dict[int, str]) -> AnalysisResult:
+        anomalies = []
+        counts: Dict[str, int] = {}
+        for box_id, probs in boxes:
+            confidences = {label: round(float(p), 3) for label, p in zip(LABELS, probs)}
+            ranked = sorted(confidences, key=confidences.get, reverse=True)
+            top = ranked[0]
+            counts[top] = counts.get(top, 0) + 1
+            anomalies.append({
+                "box_id": box_id,
+                "approximate_location": locations.get(box_id, "unknown"),
+                "possible_objects": ranked,
+                "object_confidences": confidences,
+                "notable_features": f"Most similar to {top} ({confidences[top]:.2f}) among the prompt labels",
+                "anomaly_reasoning": f"Local zero-shot CLIP classification of the anomaly crop; runner-up {ranked[1]} ({confidences[ranked[1]]:.2f})"
+            })
+
+        description = ", ".join(f"{a['possible_objects'][0]} at {a['approximate_location']}" for a in anomalies)
+        return {
+            "scene_description": f"{len(anomalies)} anomalous region(s): {description}.",
+            "anomalies": anomalies,
+            "overall_objects_detected": [{"label": label, "count": count} for label, count in counts.items()],
+            "location_type": "unknown",
+            "annotator": "local"
+        }
+
+
+class CascadeAnnotator(Annotator):
+    """Local CLIP for every frame; the remote LLM only where a person or animal is likely."""
+
+    name = "cascade"
+
+    def __init__(self, local: Annotator, remote: Annotator, threshold: float = CASCADE_THRESHOLD):
+        self.local = local
+        self.remote = remote
+        self.threshold = threshold
+
+    def needs_remote(self, annotation: Optional[AnalysisResult]) -> bool:
+        if not annotation:
+            return True
+        return any(a["object_confidences"].get(label, 0.0) >= self.threshold
+                   for a in annotation["anomalies"] for label in PRIORITY_LABELS)
+
+    def annotate_frames(self, frames, locations=None):
+        results = self.local.annotate_frames(frames, locations)
+        escalate = [(frame_id, crops) for frame_id, crops in frames if self.needs_remote(results.get(frame_id))]
+        if escalate:
+            print(f"🧠 Escalating {len(escalate)}/{len(frames)} frame(s) with likely person/animal to the LLM...")
+            for frame_id, annotation in self.remote.annotate_frames(escalate, locations).items():
+                if annotation:
+                    results[frame_id] = annotation
+        return results
+
+    def annotate_picture(self, image_path):
+        annotation = self.local.annotate_picture(image_path)
+        if self.needs_remote(annotation):
+            return self.remote.annotate_picture(image_path) or annotation
+        return annotation
+
+
+@lru_cache(maxsize=1)
+def get_annotator() -> Annotator:
+    """Annotator selected by ANNOTATOR_BACKEND."""
+    if ANNOTATOR_BACKEND == "local":
+        return ClipAnnotator()
+    if ANNOTATOR_BACKEND == "cascade":
+        return CascadeAnnotator(ClipAnnotator(), RemoteLLMAnnotator())
+    return RemoteLLMAnnotator()
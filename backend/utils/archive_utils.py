@@ -0,0 +1,228 @@
+import io
+import json
+import queue
+import threading
+import struct
+import tarfile
+import zlib
+from pathlib import Path, PurePosixPath
+from typing import Dict, Iterator, Optional, Tuple
+
+# ---- Streaming extraction of flight archives (tar / zip) ----
+#
+# Members are yielded one at a time as the upload arrives, so only the current
+# frame is held in memory, never the whole archive.
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".tif", ".tiff"}
+
+
+class StreamInterrupted(IOError):
+    """Raised by QueueReader when the producer reports a dropped upload."""
+
+
+class QueueReader(io.RawIOBase):
+    """Blocking file-like reader over chunks pushed into a queue by another thread.
+
+    The producer puts bytes chunks, then None at end of stream, or an exception
+    instance if the upload was interrupted.
+    """
+
+    def __init__(self, chunks: "queue.Queue"):
+        self._chunks = chunks
+        self._buffer = b""
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer and not self._eof:
+            chunk = self._chunks.get()
+            if chunk is None:
+                self._eof = True
+            elif isinstance(chunk, BaseException):
+                raise StreamInterrupted(str(chunk)) from chunk
+            else:
+                self._buffer = chunk
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+class PushbackReader:
+    """Exact-length reads over a stream, with the ability to push unread bytes back."""
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._pending = b""
+
+    def read(self, n: int) -> bytes:
+        data = self._pending[:n]
+        self._pending = self._pending[n:]
+        while len(data) < n:
+            chunk = self._fileobj.read(max(n - len(data), 65536))
+            if not chunk:
+                break
+            data += chunk
+        if len(data) > n:
+            self._pending = data[n:] + self._pending
+            data = data[:n]
+        return data
+
+    def read_exact(self, n: int) -> bytes:
+        data = self.read(n)
+        if len(data) != n:
+            raise EOFError("Archive stream ended unexpectedly")
+        return data
+
+    def unread(self, data: bytes):
+        self._pending = data + self._pending
+
+
+def is_image_member(name: str) -> bool:
+    path = PurePosixPath(name)
+    return path.suffix.lower() in IMAGE_EXTENSIONS and not any(p.startswith(".") or p == "__MACOSX" for p in path.parts)
+
+
+def iter_tar_members(fileobj) -> Iterator[Tuple[str, bytes]]:
+    """Yield (name, data) for regular files of a tar stream (any compression)."""
+    with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            extracted = tar.extractfile(member)
+            yield member.name, extracted.read()
+
+
+ZIP_LOCAL_HEADER = 0x04034B50
+ZIP_DATA_DESCRIPTOR = 0x08074B50
+ZIP_CENTRAL_HEADERS = {0x02014B50, 0x06054B50, 0x06064B50}
+
+
+def _zip64_sizes(extra: bytes) -> Optional[Tuple[int, int]]:
+    """Return (uncompressed, compressed) sizes from a ZIP64 extra field if present."""
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, size = struct.unpack_from("<HH", extra, offset)
+        if header_id == 0x0001 and size >= 16:
+            return struct.unpack_from("<QQ", extra, offset + 4)
+        offset += 4 + size
+    return None
+
+
+def iter_zip_members(fileobj) -> Iterator[Tuple[str, bytes]]:
+    """Yield (name, data) for files of a zip stream by walking local headers in order.
+
+    Supports stored and deflated members, including deflated members written with
+    a trailing data descriptor (sizes unknown up front), which is what most
+    streaming zip writers produce. Stops at the central directory.
+    """
+    reader = PushbackReader(fileobj)
+    while True:
+        signature_bytes = reader.read(4)
+        if len(signature_bytes) < 4:
+            return
+        (signature,) = struct.unpack("<I", signature_bytes)
+        if signature in ZIP_CENTRAL_HEADERS:
+            return
+        if signature != ZIP_LOCAL_HEADER:
+            raise ValueError(f"Unexpected zip record signature {signature:#x}")
+
+        (_, flags, method, _, _, _, csize, usize, name_len, extra_len) = struct.unpack("<HHHHHIIIHH", reader.read_exact(26))
+        name = reader.read_exact(name_len).decode("utf-8" if flags & 0x800 else "cp437")
+        extra = reader.read_exact(extra_len)
+        zip64 = _zip64_sizes(extra)
+        if zip64 and (csize == 0xFFFFFFFF or usize == 0xFFFFFFFF):
+            usize, csize = zip64
+
+        if method not in (0, 8):
+            raise ValueError(f"Unsupported zip compression method {method} for {name}")
+
+        if not flags & 0x08:
+            raw = reader.read_exact(csize)
+            data = zlib.decompress(raw, -15) if method == 8 else raw
+        else:
+            if method != 8:
+                raise ValueError(f"Stored zip member {name} without sizes cannot be streamed")
+            decompressor = zlib.decompressobj(-15)
+            parts = []
+            while not decompressor.eof:
+                chunk = reader.read(65536)
+                if not chunk:
+                    raise EOFError("Archive stream ended inside a zip member")
+                parts.append(decompressor.decompress(chunk))
+            reader.unread(decompressor.unused_data)
+            data = b"".join(parts)
+            # Data descriptor: optional signature, crc32, then 4- or 8-byte sizes
+            head = reader.read_exact(4)
+            if struct.unpack("<I", head)[0] != ZIP_DATA_DESCRIPTOR:
+                reader.unread(head)
+            reader.read_exact(4 + (16 if zip64 else 8))
+
+        if not name.endswith("/"):
+            yield name, data
+
+
+def iter_archive_members(fileobj, archive_format: str) -> Iterator[Tuple[str, bytes]]:
+    """Yield (name, data) for image members of a streamed 'zip' or 'tar' archive."""
+    if archive_format == "zip":
+        members = iter_zip_members(fileobj)
+    elif archive_format == "tar":
+        members = iter_tar_members(fileobj)
+    else:
+        raise ValueError(f"Unsupported archive format: {archive_format}")
+    for name, data in members:
+        if is_image_member(name):
+            yield name, data
+
+
+class ArchiveProgress:
+    """Per-member status of an archive upload, persisted so a re-upload can resume.
+
+    Statuses: "extracted" (written to disk, waiting for inference), "processed", "failed".
+    Updates are appended to a JSONL log, replayed (and compacted) when the progress is loaded.
+    """
+
+    def __init__(self, status_path: Path):
+        self.status_path = status_path
+        self._lock = threading.Lock()
+        self.members: Dict[str, dict] = {}
+        if status_path.exists():
+            lines = 0
+            with open(status_path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # partial line from an interrupted write
+                    name = entry.pop("name")
+                    self.members[name] = {**self.members.get(name, {}), **entry}
+                    lines += 1
+            if lines > len(self.members):
+                self._compact()
+
+    def is_processed(self, name: str) -> bool:
+        return self.members.get(name, {}).get("status") == "processed"
+
+    def mark(self, name: str, status: str, **info):
+        with self._lock:
+            update = {**info, "status": status}
+            self.members[name] = {**self.members.get(name, {}), **update}
+            self.status_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.status_path, "a") as f:
+                f.write(json.dumps({"name": name, **update}) + "\n")
+
+    def counts(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for entry in self.members.values():
+            counts[entry["status"]] = counts.get(entry["status"], 0) + 1
+        return counts
+
+    def _compact(self):
+        """Rewrite the log with one line per member."""
+        tmp_path = self.status_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            for name, entry in self.members.items():
+                f.write(json.dumps({"name": name, **entry}) + "\n")
+        tmp_path.replace(self.status_path)
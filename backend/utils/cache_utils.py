@@ -0,0 +1,106 @@
+import hashlib
+import json
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+# ---- Whole-result cache keyed by image content ----
+#
+# Identical frames (client retries, duplicate uploads, refreshes) map to the same
+# key, so the stored summary and artifact paths are returned without re-running
+# inference, rendering, annotation or embedding.
+
+ARTIFACT_KEYS = ("mask_path", "heat_map_path", "image_path", "json_path")
+
+
+def hash_file(path: Path, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Optional[dict] = None
+        self.error: Optional[BaseException] = None
+
+
+class ResultCache:
+    """Content-hash result cache that coalesces concurrent computations of the same key."""
+
+    def __init__(self, cache_dir: Path, fingerprint: str):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.fingerprint = fingerprint  # checkpoint version + thresholds + pipeline settings
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, _InFlight] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def key_for(self, image_path: Path) -> str:
+        return hashlib.sha256(f"{hash_file(image_path)}:{self.fingerprint}".encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the cached result if its artifacts still exist on disk."""
+        entry_path = self._entry_path(key)
+        if not entry_path.exists():
+            return None
+        try:
+            with open(entry_path, "r") as f:
+                value = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        # Artifacts may have been evicted by the retention manager
+        if not all(Path(value[k]).exists() for k in ARTIFACT_KEYS if k in value):
+            entry_path.unlink(missing_ok=True)
+            return None
+        return value
+
+    def put(self, key: str, value: dict):
+        entry_path = self._entry_path(key)
+        tmp_path = entry_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(value, f)
+        tmp_path.replace(entry_path)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Optional[dict]]) -> Tuple[Optional[dict], bool]:
+        """Return (result, was_cached). Concurrent callers with the same key share one computation."""
+        with self._lock:
+            cached = self.get(key)
+            if cached is not None:
+                self.hits += 1
+                return cached, True
+            in_flight = self._in_flight.get(key)
+            owner = in_flight is None
+            if owner:
+                in_flight = self._in_flight[key] = _InFlight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            in_flight.done.wait()
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.value, True
+
+        try:
+            value = compute()
+            if value is not None:
+                self.put(key, value)
+            in_flight.value = value
+            return value, False
+        except BaseException as e:
+            in_flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            in_flight.done.set()
@@ -0,0 +1,68 @@
+import os
+import threading
+from functools import lru_cache
+from typing import List
+import cv2
+import numpy as np
+import torch
+
+# ---- Local CPU CLIP model shared by the zero-shot annotator ----
+
+CLIP_MODEL = os.getenv("CLIP_MODEL", "ViT-B-32")
+CLIP_PRETRAINED = os.getenv("CLIP_PRETRAINED", "laion2b_s34b_b79k")
+CLIP_BATCH_SIZE = int(os.getenv("CLIP_BATCH_SIZE", "32"))
+
+_clip_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def load_clip():
+    """Load the open_clip model, preprocessing transform and tokenizer once per process."""
+    import open_clip
+
+    print(f"🔍 Loading CLIP {CLIP_MODEL} ({CLIP_PRETRAINED}) on CPU...")
+    model, _, preprocess = open_clip.create_model_and_transforms(CLIP_MODEL, pretrained=CLIP_PRETRAINED, device="cpu")
+    model.eval()
+    tokenizer = open_clip.get_tokenizer(CLIP_MODEL)
+    return model, preprocess, tokenizer
+
+
+def decode_png(png_bytes: bytes):
+    """PNG bytes -> PIL RGB image."""
+    from PIL import Image
+    bgr = cv2.imdecode(np.frombuffer(png_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return Image.fromarray(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB))
+
+
+def encode_images(png_crops: List[bytes], batch_size: int = CLIP_BATCH_SIZE) -> torch.Tensor:
+    """L2-normalized CLIP image embeddings (N, D) for a list of PNG crops, computed in batches."""
+    model, preprocess, _ = load_clip()
+    features = []
+    with _clip_lock, torch.inference_mode():
+        for start in range(0, len(png_crops), batch_size):
+            batch = torch.stack([preprocess(decode_png(png)) for png in png_crops[start:start + batch_size]])
+            features.append(model.encode_image(batch).float())
+    if not features:
+        return torch.empty(0, 0)
+    features = torch.cat(features)
+    return features / features.norm(dim=-1, keepdim=True)
+
+
+@lru_cache(maxsize=8)
+def encode_texts(texts: tuple) -> torch.Tensor:
+    """L2-normalized CLIP text embeddings (N, D), cached per label set."""
+    model, _, tokenizer = load_clip()
+    with _clip_lock, torch.inference_mode():
+        features = model.encode_text(tokenizer(list(texts))).float()
+    return features / features.norm(dim=-1, keepdim=True)
+
+
+def zero_shot(png_crops: List[bytes], prompts: tuple) -> np.ndarray:
+    """Softmax probabilities (N crops, M prompts) of each crop matching each text prompt."""
+    if not png_crops:
+        return np.zeros((0, len(prompts)))
+    image_features = encode_images(png_crops)
+    text_features = encode_texts(prompts)
+    model, _, _ = load_clip()
+    logits = model.logit_scale.exp().item() * image_features @ text_features.T
+    return logits.softmax(dim=-1).numpy()
@@ -0,0 +1,168 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import cv2
+import numpy as np
+
+# ---- Cross-frame deduplication of detections ----
+#
+# Overlapping survey frames show the same warm object many times. Each anomaly
+# region is clustered into a track by projected ground position and a perceptual
+# hash of its crop, so only one representative region per track needs annotation
+# and the other sightings copy that region's annotation. Tracks close after
+# DEDUP_WINDOW_S without a sighting.
+
+# Metres per pixel at the working image size, used to project region centres from the frame centre
+GROUND_SAMPLING_DISTANCE_M = float(os.getenv("GROUND_SAMPLING_DISTANCE_M", "0.1"))
+DEDUP_RADIUS_M = float(os.getenv("DEDUP_RADIUS_M", "15"))
+DEDUP_MAX_HAMMING = int(os.getenv("DEDUP_MAX_HAMMING", "12"))
+DEDUP_MAX_TRACKS = int(os.getenv("DEDUP_MAX_TRACKS", "5000"))
+# Tracks not sighted for this long are closed, so a later pass over the same spot is annotated afresh
+DEDUP_WINDOW_S = float(os.getenv("DEDUP_WINDOW_S", "900"))
+
+EARTH_RADIUS_M = 6371000.0
+GRID_CELL_DEG = 0.001  # ~100 m cells for the neighbour lookup
+
+
+def dhash(crop: np.ndarray, hash_size: int = 8) -> int:
+    """64-bit difference hash of an RGB or grayscale crop."""
+    gray = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY) if crop.ndim == 3 else crop
+    resized = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (resized[:, 1:] > resized[:, :-1]).flatten()
+    return int(sum(1 << i for i, bit in enumerate(bits) if bit))
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in metres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def project_region(lat: float, lon: float, bbox: List[int], image_shape: Tuple[int, int],
+                   gsd_m: float = GROUND_SAMPLING_DISTANCE_M) -> Tuple[float, float]:
+    """Project a region centre to ground coordinates, assuming a nadir, north-up frame centred on (lat, lon)."""
+    img_h, img_w = image_shape
+    x, y, w, h = bbox
+    east_m = (x + w / 2 - img_w / 2) * gsd_m
+    north_m = (img_h / 2 - (y + h / 2)) * gsd_m
+    dlat = math.degrees(north_m / EARTH_RADIUS_M)
+    dlon = math.degrees(east_m / (EARTH_RADIUS_M * math.cos(math.radians(lat))))
+    return lat + dlat, lon + dlon
+
+
+def region_key(detection_id: str, box_id: int) -> str:
+    return f"{detection_id}:{box_id}"
+
+
+class Track:
+    """A cluster of region detections believed to be the same ground object.
+
+    Members and the representative are region keys ("<detection_id>:<box_id>").
+    """
+
+    def __init__(self, track_id: int, detection_id: str, box_id: int, lat: float, lon: float, descriptor: int):
+        self.track_id = track_id
+        self.representative = region_key(detection_id, box_id)
+        self.members = [self.representative]
+        self.frames = {detection_id}
+        self.last_seen = time.time()
+        self.lat = lat
+        self.lon = lon
+        self.descriptor = descriptor
+        # The representative region's anomaly entry, and its frame's full annotation for scene-level fields
+        self.annotation: Optional[dict] = None
+        self.frame_annotation: Optional[dict] = None
+        self.embedding: Optional[List[float]] = None
+
+    def add(self, detection_id: str, box_id: int, lat: float, lon: float):
+        # Running mean of the ground position; keep the representative's descriptor
+        n = len(self.members)
+        self.lat = (self.lat * n + lat) / (n + 1)
+        self.lon = (self.lon * n + lon) / (n + 1)
+        self.members.append(region_key(detection_id, box_id))
+        self.frames.add(detection_id)
+        self.last_seen = time.time()
+
+
+class DetectionDeduplicator:
+    """Incrementally assigns detections to tracks as frames stream in."""
+
+    def __init__(self, radius_m: float = DEDUP_RADIUS_M, max_hamming: int = DEDUP_MAX_HAMMING,
+                 max_tracks: int = DEDUP_MAX_TRACKS, window_s: float = DEDUP_WINDOW_S):
+        self.radius_m = radius_m
+        self.max_hamming = max_hamming
+        self.max_tracks = max_tracks
+        self.window_s = window_s
+        self._tracks: "OrderedDict[int, Track]" = OrderedDict()
+        self._grid: Dict[Tuple[int, int], List[int]] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _cell(lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / GRID_CELL_DEG)), int(math.floor(lon / GRID_CELL_DEG))
+
+    def _nearby(self, lat: float, lon: float):
+        ci, cj = self._cell(lat, lon)
+        for di in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                for track_id in self._grid.get((ci + di, cj + dj), []):
+                    yield self._tracks[track_id]
+
+    def _evict_oldest(self):
+        track_id, track = self._tracks.popitem(last=False)
+        ids = self._grid.get(self._cell(track.lat, track.lon), [])
+        if track_id in ids:
+            ids.remove(track_id)
+
+    def _evict_expired(self):
+        # Tracks are kept in order of last sighting, so expired ones are at the front
+        cutoff = time.time() - self.window_s
+        while self._tracks and next(iter(self._tracks.values())).last_seen < cutoff:
+            self._evict_oldest()
+
+    def assign(self, detection_id: str, box_id: int, lat: float, lon: float,
+               descriptor: int) -> Tuple[Track, bool]:
+        """Return the matching track for a region detection and whether it started a new one.
+
+        Two regions of the same frame are distinct objects, so a track never takes a second
+        region from a frame it already has one from.
+        """
+        with self._lock:
+            self._evict_expired()
+            best, best_dist = None, None
+            for track in self._nearby(lat, lon):
+                if detection_id in track.frames or hamming(track.descriptor, descriptor) > self.max_hamming:
+                    continue
+                dist = haversine_m(lat, lon, track.lat, track.lon)
+                if dist <= self.radius_m and (best_dist is None or dist < best_dist):
+                    best, best_dist = track, dist
+
+            if best is not None:
+                # Re-index in case the running mean moved the track to another cell
+                old_cell = self._cell(best.lat, best.lon)
+                best.add(detection_id, box_id, lat, lon)
+                new_cell = self._cell(best.lat, best.lon)
+                if new_cell != old_cell:
+                    self._grid[old_cell].remove(best.track_id)
+                    self._grid.setdefault(new_cell, []).append(best.track_id)
+                self._tracks.move_to_end(best.track_id)
+                return best, False
+
+            track = Track(self._next_id, detection_id, box_id, lat, lon, descriptor)
+            self._next_id += 1
+            self._tracks[track.track_id] = track
+            self._grid.setdefault(self._cell(lat, lon), []).append(track.track_id)
+            if len(self._tracks) > self.max_tracks:
+                self._evict_oldest()
+            return track, True
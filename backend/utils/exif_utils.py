@@ -14,6 +14,11 @@ def dms_to_deg(dms, ref):
 
 def extract_gps_from_exif_or_generate(image_path: str) -> tuple[float, float]:
     """Extract GPS coordinates from EXIF or generate synthetic ones."""
+    lat, lon, _ = extract_gps(image_path)
+    return lat, lon
+
+def extract_gps(image_path: str) -> tuple[float, float, bool]:
+    """Like extract_gps_from_exif_or_generate, plus whether the coordinates are synthetic."""
     try:
         img = Image.open(image_path)
         exif_data = img.info.get("exif")
@@ -24,11 +29,11 @@ def extract_gps_from_exif_or_generate(image_path: str) -> tuple[float, float]:
             if piexif.GPSIFD.GPSLatitude in gps_info and piexif.GPSIFD.GPSLongitude in gps_info:
                 lat = dms_to_deg(gps_info[piexif.GPSIFD.GPSLatitude], gps_info[piexif.GPSIFD.GPSLatitudeRef].decode())
                 lon = dms_to_deg(gps_info[piexif.GPSIFD.GPSLongitude], gps_info[piexif.GPSIFD.GPSLongitudeRef].decode())
-                return lat, lon
+                return lat, lon, False
     except Exception as e:
         print(f"⚠️ Could not extract EXIF from {image_path}: {e}")
 
     # Generate fake GPS if EXIF missing or invalid
     lat = random.uniform(47.887088, 47.909797)
     lon = random.uniform(7.774913, 7.815842)
-    return lat, lon
+    return lat, lon, True
@@ -8,20 +8,29 @@ import numpy as np
 from skimage.segmentation import mark_boundaries
 
 
-def save_prediction_outputs(result, output_dir):
-    # Create shared output directories
-    os.makedirs(output_dir / "pickles", exist_ok=True)
+def result_to_maps(result):
+    """Convert a prediction result into (float anomaly map, bool mask) arrays."""
+    anomaly_map = result.anomaly_map.squeeze().cpu().numpy()
+    pred_mask = result.pred_mask.squeeze().cpu().numpy().astype(bool)
+    return anomaly_map, pred_mask
+
+
+def result_to_arrays(result):
+    """Convert a prediction result into (uint8 RGB image, float anomaly map, bool mask) arrays."""
+    image = result.image.squeeze().cpu().numpy().transpose(1, 2, 0)
+    image = ((image - image.min()) / (image.max() - image.min()) * 255).astype(np.uint8)
+    return (image, *result_to_maps(result))
+
+
+def save_score_outputs(result, output_dir):
+    """Write the lightweight per-frame outputs: CSV row, JSON summary and float16 anomaly map."""
     os.makedirs(output_dir / "json", exist_ok=True)
-    os.makedirs(output_dir / "images", exist_ok=True)  # Base folder for per-image folders
+    os.makedirs(output_dir / "anomaly_maps", exist_ok=True)
 
     # Get original filename (e.g., "000" from "000.png")
     original_path = Path(result.image_path[0])
     filename_stem = original_path.stem
 
-    # Create a dedicated folder for this image
-    image_folder = output_dir / "images" / filename_stem
-    image_folder.mkdir(parents=True, exist_ok=True)
-
     # CSV log (shared across all images)
     with open(output_dir / "predictions.csv", mode="a", newline="") as file:
         writer = csv.writer(file)
@@ -32,10 +41,6 @@ def save_prediction_outputs(result, output_dir):
             int(result.pred_label.item())
         ])
 
-    # Save raw result as pickle
-    with open(output_dir / "pickles" / f"{filename_stem}_result.pkl", "wb") as f:
-        pickle.dump(result, f)
-
     # Save JSON summary
     summary = {
         "pred_score": float(result.pred_score.item()),
@@ -44,11 +49,35 @@ def save_prediction_outputs(result, output_dir):
     with open(output_dir / "json" / f"{filename_stem}_summary.json", "w") as f:
         json.dump(summary, f, indent=2)
 
+    # Keep the anomaly map so missions can be re-thresholded without re-running the model
+    anomaly_map = result.anomaly_map.squeeze().cpu().numpy().astype(np.float16)
+    np.save(output_dir / "anomaly_maps" / f"{filename_stem}.npy", anomaly_map)
+
+    return int(result.pred_label.item())
+
+
+def save_prediction_outputs(result, output_dir):
+    # Create shared output directories
+    os.makedirs(output_dir / "pickles", exist_ok=True)
+    os.makedirs(output_dir / "images", exist_ok=True)  # Base folder for per-image folders
+
+    # CSV row, JSON summary and anomaly map
+    save_score_outputs(result, output_dir)
+
+    # Get original filename (e.g., "000" from "000.png")
+    original_path = Path(result.image_path[0])
+    filename_stem = original_path.stem
+
+    # Create a dedicated folder for this image
+    image_folder = output_dir / "images" / filename_stem
+    image_folder.mkdir(parents=True, exist_ok=True)
+
+    # Save raw result as pickle
+    with open(output_dir / "pickles" / f"{filename_stem}_result.pkl", "wb") as f:
+        pickle.dump(result, f)
+
     # Convert image + masks to numpy arrays
-    image = result.image.squeeze().cpu().numpy().transpose(1, 2, 0)
-    image = ((image - image.min()) / (image.max() - image.min()) * 255).astype(np.uint8)
-    anomaly_map = result.anomaly_map.squeeze().cpu().numpy()
-    pred_mask = result.pred_mask.squeeze().cpu().numpy().astype(bool)
+    image, anomaly_map, pred_mask = result_to_arrays(result)
 
     # Save original image
     image_path = image_folder / f"{filename_stem}_image.png"
@@ -67,4 +96,22 @@ def save_prediction_outputs(result, output_dir):
     mask_path = image_folder / f"{filename_stem}_mask.png"
     cv2.imwrite(str(mask_path), cv2.cvtColor(segmented, cv2.COLOR_RGB2BGR))
 
-    return int(result.pred_label.item())
\ No newline at end of file
+    return int(result.pred_label.item())
+
+
+def rethreshold_maps(anomaly_maps: np.ndarray, pred_scores: np.ndarray, pixel_threshold: float = 0.5,
+                     image_threshold: float = 0.5):
+    """Re-evaluate a stack of normalized anomaly maps (N, H, W) and scores (N,) in one vectorized pass.
+
+    Anomalib normalizes maps and scores so that the trained thresholds sit at 0.5.
+    """
+    masks = anomaly_maps >= pixel_threshold
+    anomalous_pixels = masks.sum(axis=(1, 2))
+    masked_sum = np.where(masks, anomaly_maps, 0).sum(axis=(1, 2), dtype=np.float64)
+    return {
+        "pred_label": (pred_scores >= image_threshold).astype(np.int64),
+        "anomalous_area_fraction": anomalous_pixels / masks[0].size,
+        "peak_score": anomaly_maps.max(axis=(1, 2)).astype(np.float64),
+        "mean_region_score": np.divide(masked_sum, anomalous_pixels, out=np.zeros(len(masks)), where=anomalous_pixels > 0),
+        "masks": masks
+    }
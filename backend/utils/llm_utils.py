@@ -2,7 +2,7 @@ import os
 import json
 import base64
 from pathlib import Path
-from typing import Optional, List, Dict, TypedDict
+from typing import Optional, List, Dict, Tuple, TypedDict
 from openai import OpenAI
 from dotenv import load_dotenv
 
@@ -86,34 +86,49 @@ def get_prompt() -> str:
         * Return only valid JSON — do not include any extra explanation or surrounding text.
 
 """
+def get_region_prompt(box_ids: List[int]) -> str:
+    """Return the analysis prompt adapted to cropped anomaly regions instead of a full frame."""
+    ids = ", ".join(str(b) for b in box_ids)
+    return get_prompt() + f"""
+        Region Crops:
+        * Instead of the full frame, you are given one padded crop per anomaly region, each preceded by its label "box_id: N".
+        * Report exactly one entry in "anomalies" per crop, using the same box_id ({ids}).
+        * Base "scene_description" on the crops only; the rest of the frame was judged normal by the detection model.
+
+"""
+
+def get_batch_prompt(frame_boxes: Dict[str, List[int]]) -> str:
+    """Return the analysis prompt for several frames' region crops packed into one request."""
+    listing = "\n".join(f"        * frame_id \"{frame_id}\": box_ids {box_ids}" for frame_id, box_ids in frame_boxes.items())
+    return get_prompt() + f"""
+        Batched Frames:
+        * You are given padded anomaly crops from several frames of the same flight, each preceded by its label "frame_id: X, box_id: N".
+        * Analyze every frame independently; never merge objects across frames.
+        * Instead of a single object, return {{"frames": {{"<frame_id>": <JSON object in the format above>, ...}}}} with one entry per frame.
+        * Each frame's "anomalies" must contain exactly one entry per crop of that frame, using the same box_id.
+        * Expected frames and box_ids:
+{listing}
+
+"""
+
+# Number of frames packed into one annotation request
+ANNOTATION_BATCH_SIZE = int(os.getenv("ANNOTATION_BATCH_SIZE", "4"))
+# Output budget per frame, and gpt-4o-mini's hard limit on output tokens per request
+FRAME_MAX_TOKENS = 1500
+MODEL_MAX_OUTPUT_TOKENS = 16384
+
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-def annotate_picture(image_path: str) -> Optional[AnalysisResult]:
-    """Analyze drone image with bounding boxes and return structured annotation."""
+def request_annotation(content: List[dict], max_tokens: int = FRAME_MAX_TOKENS) -> Optional[dict]:
+    """Send a prepared multimodal message to the LLM and parse its JSON reply."""
     if not os.getenv("OPENAI_API_KEY"):
         print("Error: OPENAI_API_KEY environment variable is not set")
         return None
 
-    base64_image = encode_image(image_path)
-    prompt_text = get_prompt()
-
     completion = client.chat.completions.create(
         model="gpt-4o-mini",
-        max_tokens=1500,
+        max_tokens=min(max_tokens, MODEL_MAX_OUTPUT_TOKENS),
         response_format={"type": "json_object"},
-        messages=[
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": prompt_text},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/png;base64,{base64_image}"
-                        }
-                    }
-                ]
-            }
-        ]
+        messages=[{"role": "user", "content": content}]
     )
 
     try:
@@ -123,6 +138,97 @@ def annotate_picture(image_path: str) -> Optional[AnalysisResult]:
         print(f"Error parsing JSON response: {str(e)}")
         return None
 
+def image_part(png_bytes: bytes) -> dict:
+    """Wrap PNG bytes as an image_url message part."""
+    base64_image = base64.b64encode(png_bytes).decode("utf-8")
+    return {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}}
+
+def annotate_picture(image_path: str) -> Optional[AnalysisResult]:
+    """Analyze drone image with bounding boxes and return structured annotation."""
+    base64_image = encode_image(image_path)
+    prompt_text = get_prompt()
+
+    return request_annotation([
+        {"type": "text", "text": prompt_text},
+        {
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:image/png;base64,{base64_image}"
+            }
+        }
+    ])
+
+def annotate_regions(crops: List[Tuple[int, bytes]]) -> Optional[AnalysisResult]:
+    """Analyze padded anomaly crops (box_id, PNG bytes) and return structured annotation."""
+    if not crops:
+        return None
+
+    content = [{"type": "text", "text": get_region_prompt([box_id for box_id, _ in crops])}]
+    for box_id, png_bytes in crops:
+        content.append({"type": "text", "text": f"box_id: {box_id}"})
+        content.append(image_part(png_bytes))
+    return request_annotation(content)
+
+def is_valid_frame_annotation(annotation, box_ids: List[int]) -> bool:
+    """Check that a batched reply entry has the AnalysisResult shape and the expected box_ids."""
+    if not isinstance(annotation, dict) or not isinstance(annotation.get("anomalies"), list):
+        return False
+    returned = {a.get("box_id") for a in annotation["anomalies"] if isinstance(a, dict)}
+    return set(box_ids) <= returned
+
+def annotate_single_frame(frame_id: str, crops: List[Tuple[int, bytes]]) -> Optional[AnalysisResult]:
+    """annotate_regions for one frame of a batch; a failed request leaves only that frame unannotated."""
+    try:
+        return annotate_regions(crops)
+    except Exception as e:
+        print(f"⚠️ Annotation failed for {frame_id}: {e}")
+        return None
+
+def annotate_frames(frames: List[Tuple[str, List[Tuple[int, bytes]]]],
+                    batch_size: int = ANNOTATION_BATCH_SIZE) -> Dict[str, Optional[AnalysisResult]]:
+    """Annotate region crops of several frames with one LLM request per batch.
+
+    Frames missing from a batched reply, or with a malformed entry, are retried
+    with a single-frame request. Batches are capped so every frame keeps its
+    output budget within the model's output token limit.
+    """
+    results: Dict[str, Optional[AnalysisResult]] = {}
+    frames = [(frame_id, crops) for frame_id, crops in frames if crops]
+    batch_size = min(max(batch_size, 1), MODEL_MAX_OUTPUT_TOKENS // FRAME_MAX_TOKENS)
+
+    for start in range(0, len(frames), batch_size):
+        batch = frames[start:start + batch_size]
+        if len(batch) == 1:
+            frame_id, crops = batch[0]
+            results[frame_id] = annotate_single_frame(frame_id, crops)
+            continue
+
+        frame_boxes = {frame_id: [box_id for box_id, _ in crops] for frame_id, crops in batch}
+        content = [{"type": "text", "text": get_batch_prompt(frame_boxes)}]
+        for frame_id, crops in batch:
+            for box_id, png_bytes in crops:
+                content.append({"type": "text", "text": f"frame_id: {frame_id}, box_id: {box_id}"})
+                content.append(image_part(png_bytes))
+
+        try:
+            reply = request_annotation(content, max_tokens=FRAME_MAX_TOKENS * len(batch))
+        except Exception as e:
+            print(f"⚠️ Batched annotation failed: {e}")
+            reply = None
+        reply_frames = reply.get("frames") if isinstance(reply, dict) else None
+        if not isinstance(reply_frames, dict):
+            reply_frames = {}
+
+        for frame_id, crops in batch:
+            annotation = reply_frames.get(frame_id)
+            if is_valid_frame_annotation(annotation, frame_boxes[frame_id]):
+                results[frame_id] = annotation
+            else:
+                print(f"⚠️ Malformed batched annotation for {frame_id}, retrying as single frame...")
+                results[frame_id] = annotate_single_frame(frame_id, crops)
+
+    return results
+
 # ---- Embedding helpers ----
 
 def extract_text(annotation: dict) -> str:
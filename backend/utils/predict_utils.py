@@ -0,0 +1,102 @@
+import os
+import queue
+import threading
+from typing import Iterator, Optional
+from anomalib.engine import Engine
+from lightning.pytorch.callbacks import Callback
+
+# ---- Bounded-memory streaming predict ----
+#
+# engine.predict(...) keeps every result (image tensor, float32 anomaly map, mask)
+# until the whole dataset is done. stream_predict runs prediction in a background
+# thread with return_predictions=False and hands each batch to the caller as soon
+# as it is post-processed. The hand-off queue holds at most max_in_flight batches,
+# so prediction pauses while the consumer is busy and memory stays capped.
+
+PREDICT_MAX_IN_FLIGHT = int(os.getenv("PREDICT_MAX_IN_FLIGHT", "2"))
+
+_DONE = object()
+
+
+class BatchHandoff(Callback):
+    """Pass each predicted batch to a queue once every on_predict_batch_end hook has run.
+
+    Anomalib's post-processor (normalization, thresholds) is a model callback that runs
+    after trainer callbacks like this one, so a batch is released at the start of the
+    next batch (or at epoch end), when it has been fully post-processed in place.
+    """
+
+    def __init__(self, out_queue: "queue.Queue", stop: threading.Event):
+        self.out_queue = out_queue
+        self.stop = stop
+        self.pending = None
+
+    def _flush(self):
+        if self.pending is None:
+            return
+        # Blocks while max_in_flight batches are waiting; aborts prediction if the consumer went away
+        while not self.stop.is_set():
+            try:
+                self.out_queue.put(self.pending, timeout=0.1)
+                self.pending = None
+                return
+            except queue.Full:
+                continue
+        raise RuntimeError("stream_predict consumer stopped")
+
+    def on_predict_batch_start(self, trainer, pl_module, batch, batch_idx, dataloader_idx=0):
+        self._flush()
+
+    def on_predict_batch_end(self, trainer, pl_module, outputs, batch, batch_idx, dataloader_idx=0):
+        self.pending = outputs
+
+    def on_predict_epoch_end(self, trainer, pl_module):
+        self._flush()
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def stream_predict(model, dataset, ckpt_path, max_in_flight: int = PREDICT_MAX_IN_FLIGHT,
+                   lock: Optional[threading.Lock] = None) -> Iterator:
+    """Yield prediction batches one by one, with at most max_in_flight batches held in memory."""
+    results: "queue.Queue" = queue.Queue(maxsize=max(max_in_flight, 1))
+    stop = threading.Event()
+
+    def produce():
+        try:
+            if lock is not None:
+                lock.acquire()
+            try:
+                engine = Engine(callbacks=[BatchHandoff(results, stop)])
+                engine.predict(model=model, dataset=dataset, ckpt_path=ckpt_path, return_predictions=False)
+            finally:
+                if lock is not None:
+                    lock.release()
+            item = _DONE
+        except BaseException as e:
+            item = _Failure(e)
+        # Skip the final hand-off if the consumer already gave up
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    producer = threading.Thread(target=produce, name="stream-predict", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+            del item  # drop our reference so the batch tensors can be freed
+    finally:
+        stop.set()
+        producer.join()
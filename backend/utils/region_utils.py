@@ -0,0 +1,71 @@
+from typing import List, Tuple, TypedDict
+import cv2
+import numpy as np
+
+# ---- Region extraction over pred_mask / anomaly_map ----
+
+class Region(TypedDict):
+    box_id: int
+    bbox: List[int]  # [x, y, width, height] in image pixels
+    area: int
+    peak_score: float
+    mean_score: float
+    approximate_location: str
+
+
+def describe_location(bbox: List[int], image_shape: Tuple[int, int]) -> str:
+    """Directional term ("top-left", "center", ...) for a bounding box, as used in the LLM prompt."""
+    img_h, img_w = image_shape
+    x, y, w, h = bbox
+    cx, cy = (x + w / 2) / img_w, (y + h / 2) / img_h
+    row = "top" if cy < 1 / 3 else "bottom" if cy > 2 / 3 else "center"
+    col = "left" if cx < 1 / 3 else "right" if cx > 2 / 3 else "center"
+    return "center" if row == col == "center" else f"{row}-{col}"
+
+
+def extract_regions(anomaly_map: np.ndarray, pred_mask: np.ndarray, top_k: int = 3, min_area: int = 16) -> List[Region]:
+    """Split pred_mask into connected components and rank them by peak anomaly score."""
+    mask = pred_mask.astype(np.uint8)
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+
+    regions = []
+    for label in range(1, num_labels):  # label 0 is the background
+        x, y, w, h, area = (int(v) for v in stats[label])
+        if area < min_area:
+            continue
+        scores = anomaly_map[labels == label]
+        regions.append({
+            "bbox": [x, y, w, h],
+            "area": area,
+            "peak_score": float(scores.max()),
+            "mean_score": float(scores.mean()),
+            "approximate_location": describe_location([x, y, w, h], anomaly_map.shape[:2]),
+        })
+
+    regions.sort(key=lambda r: r["peak_score"], reverse=True)
+    return [{"box_id": i, **r} for i, r in enumerate(regions[:top_k], start=1)]
+
+
+def crop_region(image: np.ndarray, region: Region, padding: float = 0.5, min_size: int = 64) -> np.ndarray:
+    """Crop a region out of an RGB image with context padding around its bounding box."""
+    img_h, img_w = image.shape[:2]
+    x, y, w, h = region["bbox"]
+    pad_w = max(int(w * padding), (min_size - w) // 2, 0)
+    pad_h = max(int(h * padding), (min_size - h) // 2, 0)
+
+    x0, y0 = max(x - pad_w, 0), max(y - pad_h, 0)
+    x1, y1 = min(x + w + pad_w, img_w), min(y + h + pad_h, img_h)
+    return image[y0:y1, x0:x1]
+
+
+def encode_crop_png(crop: np.ndarray) -> bytes:
+    """Encode an RGB crop as PNG bytes without touching disk."""
+    ok, buffer = cv2.imencode(".png", cv2.cvtColor(crop, cv2.COLOR_RGB2BGR))
+    if not ok:
+        raise ValueError("Failed to encode region crop as PNG")
+    return buffer.tobytes()
+
+
+def encode_region_crops(image: np.ndarray, regions: List[Region], padding: float = 0.5) -> List[Tuple[int, bytes]]:
+    """Padded PNG crops of already extracted regions, keyed by box_id."""
+    return [(r["box_id"], encode_crop_png(crop_region(image, r, padding=padding))) for r in regions]
@@ -0,0 +1,236 @@
+import os
+import shutil
+import tarfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# ---- Disk quota and LRU retention for uploads/, inference_outputs/, temp_processing/ ----
+# ---- and the derived stores (result cache, visual index, archive status, compile cache) ----
+#
+# Each top-level child of a managed directory is one entry (an upload, a mission
+# output folder, a scratch run, a cache file). Entries are ranked by last access;
+# heavy artifacts are dropped first so lightweight summaries survive longer.
+
+# Per-frame artifacts that can be regenerated or are only needed for debugging
+# (float16 anomaly maps are kept with the summaries so missions can still be re-thresholded)
+HEAVY_SUFFIXES = {".pkl", ".png", ".jpg", ".jpeg", ".tif", ".tiff"}
+ARCHIVE_DIRNAME = "_archive"
+
+
+class RetentionPolicy:
+    """Quota for one directory: size cap, age cap and what to do with old entries."""
+
+    def __init__(self, path: Path, max_bytes: Optional[int] = None, max_age_s: Optional[float] = None,
+                 keep_summaries: bool = True, compact: bool = False, grace_s: float = 600):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.keep_summaries = keep_summaries  # strip heavy artifacts before deleting whole entries
+        self.compact = compact  # pack stripped old entries into _archive/<entry>.tar.gz
+        self.grace_s = grace_s  # never touch entries written more recently than this
+
+
+def iter_files(path: Path):
+    if path.is_file():
+        yield path
+    elif path.is_dir():
+        for root, _, files in os.walk(path):
+            for name in files:
+                yield Path(root) / name
+
+
+def entry_stats(path: Path):
+    """Return (total bytes, heavy bytes, last access, last modification) of an entry."""
+    total = heavy = 0
+    last_access = last_modified = 0.0
+    # Stat the entry before walking it: listing a directory can bump its own atime (relatime)
+    entry_st = path.stat()
+    for file in iter_files(path):
+        try:
+            st = file.stat()
+        except FileNotFoundError:
+            continue
+        total += st.st_size
+        if file.suffix.lower() in HEAVY_SUFFIXES:
+            heavy += st.st_size
+        last_access = max(last_access, st.st_atime, st.st_mtime)
+        last_modified = max(last_modified, st.st_mtime)
+    if not last_modified:
+        last_access = last_modified = entry_st.st_mtime
+    # touch_entry() bumps the entry's own atime
+    last_access = max(last_access, entry_st.st_atime)
+    return total, heavy, last_access, last_modified
+
+
+def touch_entry(path: Path):
+    """Mark an entry as recently used, for filesystems mounted with noatime."""
+    now = time.time()
+    try:
+        os.utime(path, (now, path.stat().st_mtime))
+    except FileNotFoundError:
+        pass
+
+
+class RetentionManager:
+    """Background thread enforcing RetentionPolicy quotas and recording bytes reclaimed."""
+
+    def __init__(self, policies: List[RetentionPolicy], interval_s: float = 300):
+        self.policies = policies
+        self.interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.metrics: Dict[str, dict] = {
+            str(p.path): {"bytes_reclaimed": 0, "files_deleted": 0, "entries_deleted": 0,
+                          "entries_stripped": 0, "entries_compacted": 0, "bytes_used": 0}
+            for p in policies
+        }
+        self.last_run: Optional[float] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="retention-manager", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"⚠️ Retention pass failed: {e}")
+            self._stop.wait(self.interval_s)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"last_run": self.last_run, "directories": {k: dict(v) for k, v in self.metrics.items()}}
+
+    def run_once(self):
+        for policy in self.policies:
+            if policy.path.exists():
+                self._enforce(policy)
+        with self._lock:
+            self.last_run = time.time()
+
+    def _record(self, policy: RetentionPolicy, **deltas):
+        with self._lock:
+            metrics = self.metrics[str(policy.path)]
+            for key, value in deltas.items():
+                metrics[key] += value
+
+    def _delete_files(self, policy: RetentionPolicy, files) -> int:
+        reclaimed = deleted = 0
+        for file in files:
+            try:
+                size = file.stat().st_size
+                file.unlink()
+            except FileNotFoundError:
+                continue
+            reclaimed += size
+            deleted += 1
+        self._record(policy, bytes_reclaimed=reclaimed, files_deleted=deleted)
+        return reclaimed
+
+    def _strip_heavy(self, policy: RetentionPolicy, path: Path) -> int:
+        heavy = [f for f in iter_files(path) if f.suffix.lower() in HEAVY_SUFFIXES]
+        reclaimed = self._delete_files(policy, heavy)
+        if path.is_dir():
+            # Drop per-frame folders left empty
+            for root, dirs, files in os.walk(path, topdown=False):
+                if not dirs and not files and Path(root) != path:
+                    Path(root).rmdir()
+        if heavy:
+            self._record(policy, entries_stripped=1)
+        return reclaimed
+
+    def _delete_entry(self, policy: RetentionPolicy, path: Path) -> int:
+        size = sum(f.stat().st_size for f in iter_files(path))
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+        self._record(policy, bytes_reclaimed=size, entries_deleted=1)
+        return size
+
+    def _compact_entry(self, policy: RetentionPolicy, path: Path) -> int:
+        archive_dir = policy.path / ARCHIVE_DIRNAME
+        archive_dir.mkdir(exist_ok=True)
+        before = sum(f.stat().st_size for f in iter_files(path))
+        with tarfile.open(archive_dir / f"{path.name}.tar.gz", "w:gz") as tar:
+            tar.add(path, arcname=path.name)
+        shutil.rmtree(path, ignore_errors=True)
+        after = (archive_dir / f"{path.name}.tar.gz").stat().st_size
+        self._record(policy, bytes_reclaimed=max(before - after, 0), entries_compacted=1)
+        return max(before - after, 0)
+
+    def _enforce(self, policy: RetentionPolicy):
+        now = time.time()
+        entries = []
+        used = 0
+        for child in policy.path.iterdir():
+            if child.name == ARCHIVE_DIRNAME or child.name.startswith("."):
+                continue
+            total, heavy, last_access, last_modified = entry_stats(child)
+            used += total
+            if now - last_modified < policy.grace_s:
+                continue
+            entries.append({"path": child, "total": total, "heavy": heavy, "last_access": last_access})
+
+        # Compacted archives count against the size quota and are evicted LRU like any entry,
+        # but are not aged out again (compaction already handled their age)
+        archive_dir = policy.path / ARCHIVE_DIRNAME
+        if archive_dir.is_dir():
+            for archive in archive_dir.iterdir():
+                try:
+                    st = archive.stat()
+                except FileNotFoundError:
+                    continue
+                used += st.st_size
+                entries.append({"path": archive, "total": st.st_size, "heavy": 0,
+                                "last_access": max(st.st_atime, st.st_mtime), "archived": True})
+
+        # Least recently accessed first
+        entries.sort(key=lambda e: e["last_access"])
+
+        # Age quota: expired entries lose heavy artifacts (and are compacted) or go entirely
+        if policy.max_age_s is not None:
+            for entry in entries:
+                if now - entry["last_access"] < policy.max_age_s:
+                    break
+                if entry.get("archived"):
+                    continue
+                if policy.keep_summaries and entry["path"].is_dir():
+                    used -= self._strip_heavy(policy, entry["path"])
+                    if policy.compact:
+                        used -= self._compact_entry(policy, entry["path"])
+                        entry["gone"] = True
+                    else:
+                        entry["total"] -= entry["heavy"]
+                        entry["heavy"] = 0
+                else:
+                    used -= self._delete_entry(policy, entry["path"])
+                    entry["gone"] = True
+
+        # Size quota: strip heavy artifacts LRU-first, then delete whole entries LRU-first
+        if policy.max_bytes is not None and used > policy.max_bytes:
+            if policy.keep_summaries:
+                for entry in entries:
+                    if used <= policy.max_bytes:
+                        break
+                    if not entry.get("gone") and entry["heavy"] and entry["path"].is_dir():
+                        used -= self._strip_heavy(policy, entry["path"])
+                        entry["total"] -= entry["heavy"]
+                        entry["heavy"] = 0
+            for entry in entries:
+                if used <= policy.max_bytes:
+                    break
+                if not entry.get("gone"):
+                    used -= self._delete_entry(policy, entry["path"])
+                    entry["gone"] = True
+
+        with self._lock:
+            self.metrics[str(policy.path)]["bytes_used"] = max(used, 0)
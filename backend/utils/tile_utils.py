@@ -0,0 +1,146 @@
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+# ---- Per-zoom tile pyramid of clustered detections for mission overviews ----
+#
+# Every detection summary is folded into one grid cell per zoom level (slippy-map
+# tiles split into CELLS_PER_TILE x CELLS_PER_TILE cells). A cell keeps the count,
+# position sums for its centroid, max anomaly score and max person/animal
+# confidence, so a tile payload is a handful of small arrays regardless of how
+# many detections it covers.
+
+MIN_ZOOM = int(os.getenv("TILE_MIN_ZOOM", "0"))
+MAX_ZOOM = int(os.getenv("TILE_MAX_ZOOM", "18"))
+CELLS_PER_TILE = int(os.getenv("TILE_CELLS", "8"))
+
+
+def lat_lon_to_tile(lat: float, lon: float, z: int) -> Tuple[float, float]:
+    """Fractional Web Mercator tile coordinates of a point at zoom z."""
+    lat = max(min(lat, 85.05112878), -85.05112878)
+    n = 2 ** z
+    x = (lon + 180.0) / 360.0 * n
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n
+    return min(max(x, 0.0), n - 1e-9), min(max(y, 0.0), n - 1e-9)
+
+
+def likelihoods(summary: dict) -> Tuple[float, float]:
+    """Max person and animal confidence over a detection's annotated anomalies."""
+    person = animal = 0.0
+    for anomaly in (summary.get("annotation") or {}).get("anomalies", []):
+        confidences = anomaly.get("object_confidences", {})
+        person = max(person, float(confidences.get("person", 0.0)))
+        animal = max(animal, float(confidences.get("animal", 0.0)))
+    return person, animal
+
+
+class TileAggregator:
+    """Incrementally maintained clusters per (z, x, y) tile."""
+
+    def __init__(self, min_zoom: int = MIN_ZOOM, max_zoom: int = MAX_ZOOM, cells: int = CELLS_PER_TILE):
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.cells = cells
+        # (z, x, y) -> {(cell_x, cell_y): [count, anomalous, sum_lat, sum_lon, max_score, max_person, max_animal]}
+        self._tiles: Dict[Tuple[int, int, int], Dict[Tuple[int, int], list]] = {}
+        self._versions: Dict[Tuple[int, int, int], int] = {}
+        # Versions restart with the process, so ETags also carry the process start time
+        self.epoch = f"{time.time_ns():x}"
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def add(self, summary: dict, detection_id: Optional[str] = None) -> bool:
+        """Fold one detection summary into every zoom level; repeated detection ids are ignored.
+
+        Frame stems repeat across missions, so the id is the summary's "<run>/<stem>" detection_id.
+        """
+        # Frames without real GPS carry random fallback coordinates; they are not placed on the map
+        if "latitude" not in summary or "longitude" not in summary or summary.get("synthetic_gps"):
+            return False
+        detection_id = detection_id or summary.get("detection_id") or summary.get("id")
+        lat, lon = float(summary["latitude"]), float(summary["longitude"])
+        score = float(summary.get("pred_score", 0.0))
+        anomalous = int(summary.get("pred_label", 0) == 1)
+        person, animal = likelihoods(summary)
+
+        with self._lock:
+            if detection_id in self._seen:
+                return False
+            self._seen.add(detection_id)
+            for z in range(self.min_zoom, self.max_zoom + 1):
+                fx, fy = lat_lon_to_tile(lat, lon, z)
+                key = (z, int(fx), int(fy))
+                cell = (int((fx % 1) * self.cells), int((fy % 1) * self.cells))
+                agg = self._tiles.setdefault(key, {}).get(cell)
+                if agg is None:
+                    self._tiles[key][cell] = [1, anomalous, lat, lon, score, person, animal]
+                else:
+                    agg[0] += 1
+                    agg[1] += anomalous
+                    agg[2] += lat
+                    agg[3] += lon
+                    agg[4] = max(agg[4], score)
+                    agg[5] = max(agg[5], person)
+                    agg[6] = max(agg[6], animal)
+                self._versions[key] = self._versions.get(key, 0) + 1
+        return True
+
+    def load_directory(self, output_dir: Path) -> int:
+        """Fold in every *_summary.json below output_dir (e.g. on startup or after offline batches)."""
+        added = 0
+        for json_path in Path(output_dir).glob("**/json/*_summary.json"):
+            try:
+                with open(json_path, "r") as f:
+                    summary = json.load(f)
+                # Summaries written before detection_id existed: <run>/json/<stem>_summary.json
+                detection_id = summary.get("detection_id") or f"{json_path.parents[1].name}/{summary.get('id')}"
+                added += self.add(summary, detection_id)
+            except (OSError, json.JSONDecodeError, ValueError) as e:
+                print(f"⚠️ Skipping {json_path} for tiles: {e}")
+        return added
+
+    def tile(self, z: int, x: int, y: int) -> Tuple[dict, int]:
+        """Compact tile payload and its version.
+
+        Above max_zoom the covering max_zoom tile is filtered down to the requested bounds.
+        """
+        source = (z, x, y)
+        if z > self.max_zoom:
+            shift = z - self.max_zoom
+            source = (self.max_zoom, x >> shift, y >> shift)
+        with self._lock:
+            cells = [list(agg) for agg in self._tiles.get(source, {}).values()]
+            version = self._versions.get(source, 0)
+
+        clusters = []
+        for count, anomalous, sum_lat, sum_lon, max_score, person, animal in cells:
+            lat, lon = sum_lat / count, sum_lon / count
+            if source[0] != z:
+                fx, fy = lat_lon_to_tile(lat, lon, z)
+                if (int(fx), int(fy)) != (x, y):
+                    continue
+            clusters.append([round(lat, 6), round(lon, 6), count, anomalous,
+                             round(max_score, 4), round(person, 3), round(animal, 3)])
+
+        payload = {
+            "z": z, "x": x, "y": y,
+            "fields": ["lat", "lon", "count", "anomalous", "max_score", "max_person", "max_animal"],
+            "clusters": clusters
+        }
+        return payload, version
+
+
+_aggregator: Optional[TileAggregator] = None
+_aggregator_lock = threading.Lock()
+
+
+def get_tile_aggregator() -> TileAggregator:
+    global _aggregator
+    with _aggregator_lock:
+        if _aggregator is None:
+            _aggregator = TileAggregator()
+        return _aggregator
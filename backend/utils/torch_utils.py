@@ -0,0 +1,88 @@
+import os
+from pathlib import Path
+import torch
+
+# ---- Optional CPU-optimized inference for the PatchCore torch path ----
+#
+# Enabled with OPTIMIZED_INFERENCE=1. The ResNet18 layer2/layer3 feature extractor
+# runs on channels-last tensors; with INFERENCE_BF16=1 also under bfloat16 autocast,
+# its features cast back to float32 so the memory-bank nearest-neighbour scoring
+# stays in full precision. Both forwards are wrapped with torch.compile and run
+# under torch.inference_mode.
+#
+# bf16 is opt-in: enable it only after __testing__/cv/check_inference_drift.py has
+# shown pred_score drift within tolerance and no label flips for the deployed checkpoint.
+
+OPTIMIZED_INFERENCE = os.getenv("OPTIMIZED_INFERENCE", "0") == "1"
+INFERENCE_BF16 = os.getenv("INFERENCE_BF16", "0") == "1"
+INFERENCE_COMPILE = os.getenv("INFERENCE_COMPILE", "1") == "1"
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0"))
+
+# Inductor reuses compiled kernels from here across process restarts
+COMPILE_CACHE_DIR = Path(__file__).resolve().parent.parent / "compile_cache"
+
+
+def bf16_supported() -> bool:
+    """bfloat16 only pays off on CPUs with native support (AVX512-BF16 / AMX)."""
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+class InferenceFunction:
+    """Run a function under torch.inference_mode, compiled if possible.
+
+    If compilation fails (e.g. no C++ toolchain on the host), switch to eager for good.
+    """
+
+    def __init__(self, fn, name: str, compile_graph: bool, dynamic: bool = False):
+        self.eager = fn
+        self.name = name
+        self.compiled = None
+        if compile_graph and hasattr(torch, "compile"):
+            COMPILE_CACHE_DIR.mkdir(exist_ok=True)
+            os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", str(COMPILE_CACHE_DIR))
+            self.compiled = torch.compile(fn, dynamic=dynamic)
+
+    def __call__(self, *args, **kwargs):
+        with torch.inference_mode():
+            if self.compiled is not None:
+                try:
+                    return self.compiled(*args, **kwargs)
+                except Exception as e:
+                    print(f"⚠️ torch.compile failed for {self.name}, running eager: {e}")
+                    self.compiled = None
+            return self.eager(*args, **kwargs)
+
+
+def optimize_patchcore_for_cpu(model, bf16: bool = INFERENCE_BF16, compile_graph: bool = INFERENCE_COMPILE,
+                               threads: int = INFERENCE_THREADS):
+    """Patch a Patchcore module in place for faster CPU inference.
+
+    Only forwards are wrapped (parameters and buffers are untouched), so the
+    checkpoint that engine.predict loads still lands in the same tensors.
+    """
+    if threads > 0:
+        torch.set_num_threads(threads)
+    bf16 = bf16 and bf16_supported()
+
+    torch_model = model.model
+    feature_extractor = torch_model.feature_extractor
+    feature_extractor.to(memory_format=torch.channels_last)
+    extract = feature_extractor.forward
+
+    def extract_features(images: torch.Tensor):
+        with torch.autocast("cpu", dtype=torch.bfloat16, enabled=bf16):
+            features = extract(images.contiguous(memory_format=torch.channels_last))
+        return {layer: f.float().contiguous() for layer, f in features.items()}
+
+    feature_extractor.forward = InferenceFunction(extract_features, "feature_extractor", compile_graph)
+
+    # Scoring (distances to the memory bank) stays float32; batch and bank sizes vary, so compile dynamically
+    torch_model.nearest_neighbors = InferenceFunction(torch_model.nearest_neighbors, "nearest_neighbors",
+                                                      compile_graph, dynamic=True)
+
+    print(f"⚡ Optimized CPU inference: channels_last, bf16={'on' if bf16 else 'off'}, "
+          f"compile={'on' if compile_graph else 'off'}, threads={torch.get_num_threads()}")
+    return model
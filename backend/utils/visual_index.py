@@ -0,0 +1,186 @@
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+import numpy as np
+
+# ---- Local visual embeddings of anomaly crops for offline similarity search ----
+#
+# CLIP image embeddings of each anomaly crop are kept as append-only float16
+# shards (visual-<id>/vectors.npy with a parallel keys.json), so
+# "find detections that look like this one" needs no external service and works
+# even when LLM annotation failed. Each add writes one new shard, so disk I/O
+# grows with the batch, not with the index. Shards written by other processes
+# (e.g. batch_pipeline workers sharing VISUAL_INDEX_DIR) are picked up on the
+# next lookup; many small shards are merged when the index is loaded.
+
+VISUAL_EMBEDDINGS = os.getenv("VISUAL_EMBEDDINGS", "1") == "1"
+VISUAL_INDEX_DIR = Path(os.getenv("VISUAL_INDEX_DIR", "visual_index"))
+# Merge shards on load once there are more than this many; merged shards hold up to SHARD_ROWS rows
+MAX_SHARDS = int(os.getenv("VISUAL_INDEX_MAX_SHARDS", "64"))
+SHARD_ROWS = 65536
+
+
+def index_key(detection_id: str, box_id: int) -> str:
+    return f"{detection_id}:{box_id}"
+
+
+class VisualIndex:
+    """Float16 embedding shards with brute-force cosine search; later shards win for repeated keys."""
+
+    def __init__(self, index_dir: Path = VISUAL_INDEX_DIR):
+        self.index_dir = Path(index_dir)
+        self._lock = threading.Lock()
+        self.keys: List[str] = []
+        self.matrix: Optional[np.ndarray] = None
+        self._positions = {}
+        self._loaded = set()  # shard names already in memory
+        self._read = False  # shards are read lazily on the first lookup
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self.keys)
+
+    def _shards(self) -> List[str]:
+        """Complete shards on disk, oldest first (a shard directory appears only once fully written)."""
+        if not self.index_dir.is_dir():
+            return []
+        return sorted(p.name for p in self.index_dir.glob("visual-*") if p.is_dir())
+
+    def _merge(self, keys: List[str], vectors: np.ndarray):
+        """Fold rows into memory, replacing vectors of keys already present."""
+        base = len(self.keys)
+        new_rows = []
+        for key, vector in zip(keys, vectors):
+            position = self._positions.get(key)
+            if position is None:
+                self._positions[key] = len(self.keys)
+                self.keys.append(key)
+                new_rows.append(vector)
+            elif position >= base:
+                new_rows[position - base] = vector
+            else:
+                self.matrix[position] = vector
+        if new_rows:
+            rows = np.stack(new_rows).astype(np.float16)
+            self.matrix = rows if self.matrix is None else np.concatenate([self.matrix, rows])
+
+    def _refresh(self):
+        """Load shards not yet in memory; merge small shards on the first load."""
+        shards = [name for name in self._shards() if name not in self._loaded]
+        for name in shards:
+            try:
+                vectors = np.load(self.index_dir / name / "vectors.npy")
+                with open(self.index_dir / name / "keys.json", "r") as f:
+                    keys = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Skipping visual index shard {name}: {e}")
+                continue
+            self._merge(keys, vectors)
+            self._loaded.add(name)
+        if not self._read:
+            self._read = True
+            if len(self._loaded) > MAX_SHARDS:
+                self._compact()
+
+    def _compact(self):
+        """Rewrite the loaded shards as a few large ones."""
+        old = sorted(self._loaded)
+        self._loaded = set()
+        for start in range(0, len(self.keys), SHARD_ROWS):
+            self._loaded.add(self._write_shard(self.keys[start:start + SHARD_ROWS],
+                                               self.matrix[start:start + SHARD_ROWS]))
+        for name in old:
+            shutil.rmtree(self.index_dir / name, ignore_errors=True)
+
+    def _write_shard(self, keys: List[str], vectors: np.ndarray) -> str:
+        # Written into a hidden directory and renamed, so readers and retention only see whole shards
+        name = f"visual-{time.time_ns()}-{os.getpid()}"
+        tmp_dir = self.index_dir / f".{name}.tmp"
+        tmp_dir.mkdir(parents=True)
+        with open(tmp_dir / "vectors.npy", "wb") as f:
+            np.save(f, vectors)
+        with open(tmp_dir / "keys.json", "w") as f:
+            json.dump(keys, f)
+        tmp_dir.rename(self.index_dir / name)
+        return name
+
+    def add(self, keys: List[str], vectors: np.ndarray):
+        """Add (or replace) L2-normalized vectors as one new shard."""
+        vectors = np.asarray(vectors, dtype=np.float16)
+        with self._lock:
+            name = self._write_shard(list(keys), vectors)
+            # Only keep rows in memory once the index has been read (writers such as batch workers never search)
+            if self._read:
+                self._merge(keys, vectors)
+                self._loaded.add(name)
+
+    def vector(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            self._refresh()
+            position = self._positions.get(key)
+            return None if position is None else self.matrix[position].astype(np.float32)
+
+    def search(self, query: np.ndarray, k: int = 10, exclude_prefix: Optional[str] = None,
+               chunk_size: int = 65536) -> List[Tuple[str, float]]:
+        """Top-k keys by cosine similarity to an L2-normalized query vector."""
+        with self._lock:
+            self._refresh()
+            if self.matrix is None or not len(self.keys):
+                return []
+            matrix, keys = self.matrix, list(self.keys)
+        query = np.asarray(query, dtype=np.float32)
+        # float16 storage, float32 math, chunked to bound the temporary
+        scores = np.concatenate([
+            matrix[start:start + chunk_size].astype(np.float32) @ query
+            for start in range(0, len(keys), chunk_size)
+        ])
+        if exclude_prefix is not None:
+            for i, key in enumerate(keys):
+                if key.startswith(exclude_prefix):
+                    scores[i] = -np.inf
+        top = np.argsort(-scores)[:k]
+        return [(keys[i], float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+
+_index: Optional[VisualIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_visual_index() -> VisualIndex:
+    """Process-wide visual index; shards are read from disk on first lookup."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = VisualIndex()
+        return _index
+
+
+def embed_detections(frames: List[Tuple[str, List[Tuple[int, bytes]]]]) -> int:
+    """Embed all anomaly crops of a batch of frames in one pass and add them to the index.
+
+    frame ids must be unique across runs (see process_pipeline's detection_id).
+    """
+    global VISUAL_EMBEDDINGS
+    keys = [index_key(frame_id, box_id) for frame_id, crops in frames for box_id, _ in crops]
+    if not VISUAL_EMBEDDINGS or not keys:
+        return 0
+    try:
+        from utils.clip_utils import encode_images, load_clip
+        load_clip()
+    except Exception as e:
+        # open_clip missing or the model cannot be loaded: stop trying for this process
+        print(f"⚠️ Visual embeddings disabled, CLIP image encoder unavailable: {e}")
+        VISUAL_EMBEDDINGS = False
+        return 0
+    try:
+        vectors = encode_images([png for _, crops in frames for _, png in crops]).numpy()
+    except Exception as e:
+        print(f"⚠️ Visual embedding failed for {len(frames)} frame(s): {e}")
+        return 0
+    get_visual_index().add(keys, vectors)
+    return len(keys)